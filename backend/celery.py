@@ -1,9 +1,21 @@
 # payment_upload/celery.py
 import os
 from celery import Celery
+from celery.signals import worker_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 app = Celery('backend')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_init.connect
+def preload_parsers(**kwargs):
+    """
+    Import the document parsers once in the worker's parent process, before
+    the prefork pool forks, so each child (including ones started by
+    autoscaling) shares them instead of importing python-docx / lxml again.
+    Web processes never import them unless they parse a file.
+    """
+    import docx  # noqa: F401
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 import os
 from pathlib import Path
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -52,23 +53,182 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.SessionAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "core.authentication.CachedTokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
     ),
+    # Reverse proxies in front of gunicorn. Client IPs for the per-IP rate
+    # limits are read from the X-Forwarded-For entry the outermost proxy
+    # appended, so clients cannot pick their own; use 0 when gunicorn or
+    # runserver is reached directly (REMOTE_ADDR is used).
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", "1")),
+}
+
+
+# Token-bucket rate limits per endpoint scope, per user and per client IP
+# (core.throttling). Buckets are kept in Redis when RATE_LIMIT_REDIS_URL is set.
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')
+RATE_LIMITS = {
+    'upload': {'user': '30/min', 'ip': '60/min'},
+    'upload_chunk': {'user': '600/min', 'ip': '1200/min'},
+    'payment': {'user': '10/min', 'ip': '30/min'},
+    'payment_callback': {'ip': '120/min'},
 }
 
 
 # Celery / Redis
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_BEAT_SCHEDULE = {
+    'purge-deleted-files': {
+        'task': 'core.tasks.purge_deleted_files',
+        'schedule': timedelta(minutes=5),
+    },
+    'collect-orphaned-uploads': {
+        'task': 'core.tasks.collect_orphaned_uploads',
+        'schedule': timedelta(hours=24),
+    },
+    'expire-upload-sessions': {
+        'task': 'core.tasks.expire_upload_sessions',
+        'schedule': timedelta(hours=1),
+    },
+    'dispatch-pending-files': {
+        'task': 'core.tasks.dispatch_pending_files',
+        'schedule': timedelta(seconds=30),
+    },
+}
+# Redeliver a file task whose worker died (hard time limit, OOM kill) so the
+# crash counts towards FILE_TASK_QUARANTINE_AFTER instead of being lost.
+CELERY_TASK_ACKS_LATE = os.getenv('CELERY_TASK_ACKS_LATE', '1') == '1'
+CELERY_TASK_REJECT_ON_WORKER_LOST = CELERY_TASK_ACKS_LATE
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.getenv('CELERY_WORKER_PREFETCH_MULTIPLIER', '1'))
+# Redis redelivers messages not acknowledged within this many seconds,
+# including countdown / ETA tasks still waiting to run
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv('CELERY_VISIBILITY_TIMEOUT', '3600'))
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': CELERY_VISIBILITY_TIMEOUT}
+
+# process_file_task retries transient errors (storage / database outages)
+# with exponential backoff and jitter, then records a DeadLetter.
+FILE_TASK_MAX_RETRIES = int(os.getenv('FILE_TASK_MAX_RETRIES', '5'))
+FILE_TASK_RETRY_BACKOFF = int(os.getenv('FILE_TASK_RETRY_BACKOFF', '10'))
+FILE_TASK_RETRY_BACKOFF_MAX = int(os.getenv('FILE_TASK_RETRY_BACKOFF_MAX', '600'))
+# A file that crashes or times out the parser this many times is quarantined
+FILE_TASK_QUARANTINE_AFTER = int(os.getenv('FILE_TASK_QUARANTINE_AFTER', '3'))
+# Soft limit = base + seconds per MB, capped; the hard limit adds a grace period
+FILE_TASK_SOFT_TIME_LIMIT_BASE = int(os.getenv('FILE_TASK_SOFT_TIME_LIMIT_BASE', '30'))
+FILE_TASK_SECONDS_PER_MB = float(os.getenv('FILE_TASK_SECONDS_PER_MB', '6'))
+FILE_TASK_MAX_TIME_LIMIT = int(os.getenv('FILE_TASK_MAX_TIME_LIMIT', '900'))
+FILE_TASK_HARD_TIME_LIMIT_GRACE = int(os.getenv('FILE_TASK_HARD_TIME_LIMIT_GRACE', '30'))
+
+# Fair-share dispatch (core.dispatch): files wait in the database and are sent
+# to Celery only while fewer than MAX_IN_FLIGHT are queued or running, each
+# free slot going to the user with the least work in flight. Small files get
+# their own slots and queue; workers must consume it too
+# (celery worker -Q celery,files.priority). Weights: "premium:4,team:2".
+FILE_DISPATCH_FAIR_SHARE = os.getenv('FILE_DISPATCH_FAIR_SHARE', '0') == '1'
+FILE_DISPATCH_MAX_IN_FLIGHT = int(os.getenv('FILE_DISPATCH_MAX_IN_FLIGHT', '8'))
+FILE_DISPATCH_PRIORITY_QUEUE = os.getenv('FILE_DISPATCH_PRIORITY_QUEUE', 'files.priority')
+FILE_DISPATCH_PRIORITY_MAX_IN_FLIGHT = int(os.getenv('FILE_DISPATCH_PRIORITY_MAX_IN_FLIGHT', '4'))
+FILE_DISPATCH_SMALL_FILE_BYTES = int(os.getenv('FILE_DISPATCH_SMALL_FILE_BYTES', str(256 * 1024)))
+FILE_DISPATCH_GROUP_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (
+        item.partition(':') for item in filter(None, os.getenv('FILE_DISPATCH_GROUP_WEIGHTS', '').split(','))
+    )
+}
+if any(weight <= 0 for weight in FILE_DISPATCH_GROUP_WEIGHTS.values()):
+    raise ImproperlyConfigured("FILE_DISPATCH_GROUP_WEIGHTS must all be greater than 0.")
+FILE_DISPATCH_STALE_AFTER = timedelta(seconds=int(os.getenv('FILE_DISPATCH_STALE_AFTER', '3600')))
+# Dispatchers take a cache lock so they never hand out the same free slots
+# twice; across processes this needs the shared cache (CACHE_URL). A lock
+# left by a killed dispatcher expires after this many seconds.
+FILE_DISPATCH_LOCK_TIMEOUT = int(os.getenv('FILE_DISPATCH_LOCK_TIMEOUT', '60'))
 
 # aamarPay config (from env)
 AAMARPAY_STORE_ID = os.getenv("AAMARPAY_STORE_ID", "aamarpaytest")
 AAMARPAY_SIGNATURE_KEY = os.getenv("AAMARPAY_SIGNATURE_KEY", "dbb74894e82415a2f7ff0ec3a97e4183")
 AAMARPAY_ENDPOINT = os.getenv("AAMARPAY_ENDPOINT", "https://sandbox.aamarpay.com/jsonpost.php")
 
+# Admission control for uploads (core.admission). Past either threshold new
+# uploads get 503 + Retry-After ('reject') or have processing delayed ('defer').
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_MODE = os.getenv('ADMISSION_MODE', 'reject')
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv('ADMISSION_MAX_QUEUE_DEPTH', '1000'))
+ADMISSION_MAX_OLDEST_AGE = int(os.getenv('ADMISSION_MAX_OLDEST_AGE', '600'))
+ADMISSION_AVG_TASK_SECONDS = float(os.getenv('ADMISSION_AVG_TASK_SECONDS', '2'))
+ADMISSION_WORKER_CONCURRENCY = int(os.getenv('ADMISSION_WORKER_CONCURRENCY', '4'))
+ADMISSION_STATE_TTL = int(os.getenv('ADMISSION_STATE_TTL', '2'))
+ADMISSION_STALE_AFTER = timedelta(seconds=int(os.getenv('ADMISSION_STALE_AFTER', '3600')))
+# Longest delay 'defer' mode may give; longer estimates are rejected, since
+# countdowns past the broker's visibility timeout are delivered twice
+ADMISSION_MAX_DEFER = min(
+    int(os.getenv('ADMISSION_MAX_DEFER', '3000')), CELERY_VISIBILITY_TIMEOUT - 60
+)
+# Also read the broker queue length (Redis LLEN / AMQP message count)
+ADMISSION_USE_BROKER = os.getenv('ADMISSION_USE_BROKER', '0') == '1'
+
+# Approximate distinct-word counting (HyperLogLog) in process_file_task.
+# Precision p uses 2**p bytes per file with ~1.04/sqrt(2**p) standard error.
+WORD_SKETCH_ENABLED = os.getenv('WORD_SKETCH_ENABLED', '1') == '1'
+WORD_SKETCH_PRECISION = int(os.getenv('WORD_SKETCH_PRECISION', '12'))
+
+# Full-text search index built by process_file_task (core.search). Backend
+# 'auto' picks PostgreSQL tsvector, SQLite FTS5 or the pure-Python index,
+# which has no inverted index and is only meant for tests and development.
+SEARCH_INDEX_ENABLED = os.getenv('SEARCH_INDEX_ENABLED', '1') == '1'
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+SEARCH_CONFIG = os.getenv('SEARCH_CONFIG', 'simple')
+SEARCH_MAX_TERMS = int(os.getenv('SEARCH_MAX_TERMS', '20000'))
+SEARCH_MAX_TERM_REPEATS = int(os.getenv('SEARCH_MAX_TERM_REPEATS', '4'))
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '500'))
+
+# Text previews (core.previews): built from the start of a file on first
+# request and kept in a per-process LRU cache bounded by PREVIEW_CACHE_BYTES.
+PREVIEW_MAX_LINES = int(os.getenv('PREVIEW_MAX_LINES', '50'))
+PREVIEW_MAX_WORDS = int(os.getenv('PREVIEW_MAX_WORDS', '500'))
+PREVIEW_READ_BYTES = int(os.getenv('PREVIEW_READ_BYTES', str(64 * 1024)))
+PREVIEW_CACHE_BYTES = int(os.getenv('PREVIEW_CACHE_BYTES', str(8 * 1024 * 1024)))
+
+# Cache: Redis when CACHE_URL is set. Web and Celery processes must share it
+# for the per-user list versions (core.cache) to invalidate across processes.
+CACHE_URL = os.getenv('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+LIST_CACHE_TIMEOUT = int(os.getenv('LIST_CACHE_TIMEOUT', '300'))
+
+# Token / session user lookups are cached (core.authentication) only with a
+# shared cache, so logout and token rotation invalidate them everywhere.
+AUTH_CACHE_TIMEOUT = int(os.getenv('AUTH_CACHE_TIMEOUT', '60' if CACHE_URL else '0'))
+# ModelBackend stays listed so sessions created before CachedModelBackend
+# (which store its path as their backend) remain valid.
+AUTHENTICATION_BACKENDS = [
+    'core.authentication.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+# Sessions are read from Redis and written through to the database
+SESSION_ENGINE = os.getenv(
+    'SESSION_ENGINE',
+    'django.contrib.sessions.backends.cached_db' if CACHE_URL else 'django.contrib.sessions.backends.db',
+)
+
+# Admin changelists switch from COUNT(*) to the planner's estimate above this
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))
+
+# Rows fetched per round trip by the streaming CSV/NDJSON exports
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
 # Database Configuration
 DATABASE_URL = os.getenv('DATABASE_URL')
 
@@ -109,6 +269,49 @@ else:
         }
     }
 
+# Read replicas (core.routers), comma-separated URLs, e.g.
+# "sqlite:///replica.sqlite3" locally. Tests read them through the primary.
+DATABASE_REPLICAS = []
+for _index, _url in enumerate(filter(None, os.getenv('DATABASE_REPLICA_URLS', '').split(',')), 1):
+    import dj_database_url
+    _alias = f'replica{_index}'
+    DATABASES[_alias] = dj_database_url.parse(_url.strip())
+    DATABASES[_alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(_alias)
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# How long a user's reads stay on the primary after they write
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
+# Connection reuse. Web requests and Celery tasks (through Celery's Django
+# fixup) both close connections older than CONN_MAX_AGE at their end, so one
+# setting covers gunicorn and workers. Modes (DB_CONNECTION_MODE):
+#   persistent - each process keeps its connection for DB_CONN_MAX_AGE seconds
+#   pool       - psycopg 3 connection pool inside each process (Django 5.1+)
+#   pgbouncer  - short-lived connections to PgBouncer in transaction pooling
+#                mode, which cannot hold server-side cursors across statements
+DB_CONNECTION_MODE = os.getenv('DB_CONNECTION_MODE', 'persistent')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '60'))
+DB_CONN_HEALTH_CHECKS = os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1'
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+
+for _database in DATABASES.values():
+    _database['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    _database['CONN_HEALTH_CHECKS'] = DB_CONN_HEALTH_CHECKS
+    if 'postgresql' not in _database['ENGINE']:
+        continue
+    if DB_CONNECTION_MODE == 'pool':
+        # Requires psycopg 3; the pool manages connection lifetime itself
+        _database['CONN_MAX_AGE'] = 0
+        _database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': DB_POOL_TIMEOUT,
+        }
+    elif DB_CONNECTION_MODE == 'pgbouncer':
+        _database['DISABLE_SERVER_SIDE_CURSORS'] = True
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files
@@ -184,9 +387,70 @@ STATICFILES_DIRS = [
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Resumable chunked uploads: chunks are staged here until the upload completes
+CHUNKED_UPLOAD_DIR = Path(os.getenv('CHUNKED_UPLOAD_DIR', MEDIA_ROOT / 'chunks'))
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', 500 * 1024 * 1024))
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024))
+CHUNKED_UPLOAD_EXPIRY = timedelta(hours=int(os.getenv('CHUNKED_UPLOAD_EXPIRY_HOURS', '24')))
+
+# Deleted uploads are soft-deleted and purged from storage in batches by
+# purge_deleted_files; blobs no row refers to are collected after a grace period.
+BULK_DELETE_MAX_FILES = int(os.getenv('BULK_DELETE_MAX_FILES', '1000'))
+FILE_PURGE_BATCH_SIZE = int(os.getenv('FILE_PURGE_BATCH_SIZE', '500'))
+FILE_PURGE_MAX_BATCHES = int(os.getenv('FILE_PURGE_MAX_BATCHES', '20'))
+ORPHAN_UPLOAD_GRACE = timedelta(hours=int(os.getenv('ORPHAN_UPLOAD_GRACE_HOURS', '6')))
+
 # WhiteNoise configuration for static files
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Upload storage: 'local' (MEDIA_ROOT) or 's3' for any S3-compatible service
+# (AWS, MinIO, ...) via django-storages. Uploads are sharded into
+# UPLOAD_SHARD_DEPTH levels of hash-prefixed directories.
+FILE_STORAGE_BACKEND = os.getenv('FILE_STORAGE_BACKEND', 'local')
+UPLOAD_SHARD_DEPTH = int(os.getenv('UPLOAD_SHARD_DEPTH', '2'))
+UPLOAD_SHARD_WIDTH = int(os.getenv('UPLOAD_SHARD_WIDTH', '2'))
+# On S3, downloads redirect to a presigned URL valid for
+# FILE_DOWNLOAD_URL_EXPIRE seconds instead of streaming through Django
+# (compressed files are still decompressed here for clients that need it).
+FILE_DOWNLOAD_REDIRECT = os.getenv(
+    'FILE_DOWNLOAD_REDIRECT', '1' if FILE_STORAGE_BACKEND == 's3' else '0'
+) == '1'
+FILE_DOWNLOAD_URL_EXPIRE = int(os.getenv('FILE_DOWNLOAD_URL_EXPIRE', '300'))
+# Compressed storage (core.compression): 'auto' (zstd if installed, else
+# gzip), 'zstd', 'gzip' or 'off'. Files whose sample does not shrink by
+# UPLOAD_COMPRESSION_MIN_RATIO are stored raw.
+UPLOAD_COMPRESSION = os.getenv('UPLOAD_COMPRESSION', 'auto')
+UPLOAD_COMPRESSION_MIN_RATIO = float(os.getenv('UPLOAD_COMPRESSION_MIN_RATIO', '1.5'))
+UPLOAD_COMPRESSION_LEVEL_GZIP = int(os.getenv('UPLOAD_COMPRESSION_LEVEL_GZIP', '6'))
+UPLOAD_COMPRESSION_LEVEL_ZSTD = int(os.getenv('UPLOAD_COMPRESSION_LEVEL_ZSTD', '3'))
+
+if FILE_STORAGE_BACKEND == 's3':
+    DEFAULT_STORAGE = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': os.getenv('S3_BUCKET_NAME', 'uploads'),
+            'endpoint_url': os.getenv('S3_ENDPOINT_URL') or None,
+            'access_key': os.getenv('S3_ACCESS_KEY_ID'),
+            'secret_key': os.getenv('S3_SECRET_ACCESS_KEY'),
+            'region_name': os.getenv('S3_REGION_NAME') or None,
+            'addressing_style': os.getenv('S3_ADDRESSING_STYLE', 'path'),
+            'file_overwrite': False,
+            'querystring_auth': True,
+        },
+    }
+else:
+    DEFAULT_STORAGE = {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    }
+
+# Django 5.1+ only reads STORAGES; the static backend keeps the previous default.
+STORAGES = {
+    'default': DEFAULT_STORAGE,
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -1,42 +1,204 @@
+import json
+from datetime import timedelta
+
+from django.conf import settings
 from django.contrib import admin
-from .models import FileUpload, PaymentTransaction, ActivityLog
+from django.core.cache import cache
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .dispatch import enqueue_file_processing
+from .models import DeadLetter, FileUpload, PaymentTransaction, ActivityLog, UserStats
+from .routers import replica_reads
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the PostgreSQL planner's row estimate instead of COUNT(*) once a
+    changelist is larger than ADMIN_ESTIMATED_COUNT_THRESHOLD rows.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+            if estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for multi-million-row tables: joined user loading,
+    estimated pagination counts, no ``date_hierarchy`` (it runs a DISTINCT
+    date query over the whole table; the date ``list_filter`` does not),
+    searches limited to exact / prefix lookups that can use B-tree indexes
+    instead of ``icontains`` scans, and reads from a replica when one is
+    configured.
+    """
+    list_select_related = ('user',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    prefix_search_fields = ()
+    exact_search_fields = ()
+    # Large columns only shown on the detail page
+    changelist_defer = ()
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        match = request.resolver_match
+        if self.changelist_defer and match and (match.url_name or '').endswith('_changelist'):
+            queryset = queryset.defer(*self.changelist_defer)
+        return queryset
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            # Bulk actions read and write the selected rows
+            return super().changelist_view(request, extra_context)
+        with replica_reads(request.user):
+            response = super().changelist_view(request, extra_context)
+            # The result list is only queried while the template renders
+            if hasattr(response, 'render'):
+                response.render()
+            return response
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+
+        users = get_user_model().objects.filter(username=term).values('pk')
+        condition = Q(user__in=users)
+        for field in self.prefix_search_fields:
+            condition |= Q(**{f'{field}__startswith': term})
+        for field in self.exact_search_fields:
+            condition |= Q(**{field: term})
+        return queryset.filter(condition), False
+
+
+class RecentActionListFilter(admin.SimpleListFilter):
+    """
+    Offers the actions logged recently instead of ``SELECT DISTINCT action``
+    over the whole table; the choice list itself is cached.
+    """
+    title = 'action'
+    parameter_name = 'action'
+    window = timedelta(days=30)
+    cache_timeout = 600
+
+    def lookups(self, request, model_admin):
+        actions = cache.get('admin:activity-actions')
+        if actions is None:
+            actions = sorted(
+                ActivityLog.objects.filter(timestamp__gte=timezone.now() - self.window)
+                .order_by().values_list('action', flat=True).distinct()
+            )
+            cache.set('admin:activity-actions', actions, self.cache_timeout)
+        return [(action, action) for action in actions]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(action=self.value())
+        return queryset
 
 
 @admin.register(FileUpload)
-class FileUploadAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'filename', 'status', 'word_count', 'upload_time')
-    readonly_fields = ('user', 'filename', 'upload_time', 'word_count', 'status', 'file')
+class FileUploadAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'filename', 'status', 'word_count', 'processing_attempts', 'upload_time')
+    readonly_fields = ('user', 'filename', 'size', 'upload_time', 'word_count', 'status',
+                       'processing_attempts', 'file')
     list_filter = ('status', 'upload_time')
     search_fields = ('filename', 'user__username')
-    
+    search_help_text = "Filename prefix or exact username."
+    prefix_search_fields = ('filename',)
+    changelist_defer = ('word_sketch',)
+
     def has_delete_permission(self, request, obj=None):
         return False
-    
+
     def has_change_permission(self, request, obj=None):
         # prevent updates through admin (read only)
         return False
 
 
 @admin.register(PaymentTransaction)
-class PaymentTransactionAdmin(admin.ModelAdmin):
+class PaymentTransactionAdmin(LargeTableAdmin):
     list_display = ('transaction_id', 'user', 'amount', 'status', 'timestamp')
     readonly_fields = ('transaction_id', 'user', 'amount', 'status', 'gateway_response', 'timestamp')
     list_filter = ('status', 'timestamp')
     search_fields = ('transaction_id', 'user__username')
-    
+    search_help_text = "Transaction ID (exact or prefix) or exact username."
+    prefix_search_fields = ('transaction_id',)
+    changelist_defer = ('gateway_response',)
+
     def has_delete_permission(self, request, obj=None):
         return False
-    
+
     def has_change_permission(self, request, obj=None):
         return False
 
 
 @admin.register(ActivityLog)
-class ActivityLogAdmin(admin.ModelAdmin):
+class ActivityLogAdmin(LargeTableAdmin):
     list_display = ('user', 'action', 'timestamp')
     readonly_fields = ('user', 'action', 'metadata', 'timestamp')
-    list_filter = ('action', 'timestamp')
+    list_filter = (RecentActionListFilter, 'timestamp')
     search_fields = ('user__username', 'action')
-    
+    search_help_text = "Exact action or exact username."
+    exact_search_fields = ('action',)
+    changelist_defer = ('metadata',)
+
     def has_delete_permission(self, request, obj=None):
         return False
+
+
+@admin.register(UserStats)
+class UserStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'file_count', 'word_count', 'payment_count', 'total_spent', 'updated_at')
+    readonly_fields = ('user', 'file_count', 'word_count', 'payment_count', 'total_spent', 'updated_at')
+    search_fields = ('user__username',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DeadLetter)
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('task_name', 'file_upload', 'reason', 'retries', 'created_at', 'requeued_at')
+    readonly_fields = ('task_name', 'task_id', 'args', 'file_upload', 'reason', 'exception',
+                       'traceback', 'retries', 'created_at', 'requeued_at')
+    list_filter = ('reason', 'created_at')
+    list_select_related = ('file_upload',)
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Requeue the files of selected dead letters")
+    def requeue(self, request, queryset):
+        requeued = 0
+        for letter in queryset.filter(requeued_at__isnull=True, file_upload__isnull=False):
+            file_upload = letter.file_upload
+            file_upload.status = 'processing'
+            file_upload.processing_attempts = 0
+            file_upload.save(update_fields=['status', 'processing_attempts'])
+            enqueue_file_processing(file_upload)
+            letter.requeued_at = timezone.now()
+            letter.save(update_fields=['requeued_at'])
+            requeued += 1
+        self.message_user(request, f"Requeued {requeued} file(s).")
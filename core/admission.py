@@ -0,0 +1,118 @@
+"""
+Admission control for file processing.
+
+Before accepting an upload the views look at the processing backlog: how
+many files are waiting (including files fair-share dispatch has not sent
+to the broker yet) and how long the oldest has been waiting. Past
+``ADMISSION_MAX_QUEUE_DEPTH`` / ``ADMISSION_MAX_OLDEST_AGE`` new uploads are
+rejected with 503 and an estimated wait (``ADMISSION_MODE = 'reject'``) or
+accepted with their processing deferred by that estimate (``'defer'``) as
+long as it stays within ``ADMISSION_MAX_DEFER``, below the broker's
+visibility timeout; longer estimates are rejected in either mode.
+The measured state is cached for ``ADMISSION_STATE_TTL`` seconds so the
+check costs at most one small indexed query per interval.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import FileUpload
+
+logger = logging.getLogger(__name__)
+
+STATE_CACHE_KEY = 'admission:queue-state'
+
+
+def _broker_queue_depth():
+    """Messages waiting in the Celery broker queue, or None if unavailable."""
+    from backend.celery import app
+
+    try:
+        with app.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            queue = connection.default_channel.queue_declare(
+                queue=app.conf.task_default_queue, passive=True
+            )
+            return queue.message_count
+    except Exception:
+        logger.warning("Could not read the broker queue depth", exc_info=True)
+        return None
+
+
+def measure_queue_state():
+    now = timezone.now()
+    # Rows stuck in 'processing' for longer than this are not a backlog
+    # signal (e.g. a worker was killed mid-task) and must not block uploads.
+    backlog = FileUpload.objects.filter(
+        status='processing', upload_time__gte=now - settings.ADMISSION_STALE_AFTER
+    ).aggregate(
+        depth=Count('id'),
+        oldest=Min('upload_time'),
+        # Held back by fair-share dispatch, not yet in the broker
+        pending=Count('id', filter=Q(dispatched_at__isnull=True)),
+    )
+
+    depth = backlog['depth']
+    if settings.ADMISSION_USE_BROKER:
+        broker_depth = _broker_queue_depth()
+        if broker_depth is not None:
+            depth = max(depth, broker_depth)
+
+    oldest_age = (now - backlog['oldest']).total_seconds() if backlog['oldest'] else 0.0
+    estimated_wait = math.ceil(
+        depth * settings.ADMISSION_AVG_TASK_SECONDS / settings.ADMISSION_WORKER_CONCURRENCY
+    )
+    overloaded = (
+        depth >= settings.ADMISSION_MAX_QUEUE_DEPTH
+        or oldest_age >= settings.ADMISSION_MAX_OLDEST_AGE
+    )
+    return {
+        'depth': depth,
+        'pending': backlog['pending'] if settings.FILE_DISPATCH_FAIR_SHARE else 0,
+        'oldest_age': round(oldest_age, 1),
+        'estimated_wait': estimated_wait,
+        'accepting': not overloaded or (
+            settings.ADMISSION_MODE == 'defer' and estimated_wait <= settings.ADMISSION_MAX_DEFER
+        ),
+        'overloaded': overloaded,
+        'mode': settings.ADMISSION_MODE,
+    }
+
+
+def queue_state():
+    state = cache.get(STATE_CACHE_KEY)
+    if state is None:
+        state = measure_queue_state()
+        cache.set(STATE_CACHE_KEY, state, settings.ADMISSION_STATE_TTL)
+    return state
+
+
+def admission_decision():
+    """
+    Returns ``(admit, countdown, state)``: whether to accept the upload and
+    how many seconds to delay its processing (None to start right away).
+    """
+    if not settings.ADMISSION_ENABLED:
+        return True, None, None
+    state = queue_state()
+    if not state['overloaded']:
+        return True, None, state
+    if settings.ADMISSION_MODE == 'defer' and state['estimated_wait'] <= settings.ADMISSION_MAX_DEFER:
+        return True, max(state['estimated_wait'], 1), state
+    return False, None, state
+
+
+def overloaded_response_data(state):
+    return {
+        "error": "Processing queue is full. Please retry later.",
+        "estimated_wait": state['estimated_wait'],
+        "queue": state,
+    }
+
+
+def retry_after(state):
+    return str(max(1, min(state['estimated_wait'], 3600)))
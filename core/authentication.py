@@ -0,0 +1,77 @@
+"""
+Cached request authentication.
+
+Token and session authentication each cost a query per request (token
+joined to its user, or the session's user by id) before any view code runs.
+Both are served from the cache for ``AUTH_CACHE_TIMEOUT`` seconds and
+dropped once a change to the token, the user or their groups and
+permissions commits (see signals.py). Caching is off when the timeout is 0, which is the
+default without a shared cache: an in-process cache could not be
+invalidated from other processes.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def _token_cache_key(key):
+    # Keep raw tokens out of cache keys
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def _user_cache_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def invalidate_token(key):
+    cache.delete(_token_cache_key(key))
+
+
+def invalidate_user(user_id):
+    keys = [_user_cache_key(user_id)]
+    keys += [_token_cache_key(key) for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True)]
+    cache.delete_many(keys)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        if not settings.AUTH_CACHE_TIMEOUT:
+            return super().authenticate_credentials(key)
+
+        cache_key = _token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            # Invalid keys and inactive users raise and are not cached
+            user, token = super().authenticate_credentials(key)
+            cache.set(cache_key, token, settings.AUTH_CACHE_TIMEOUT)
+        return token.user, token
+
+
+class CachedModelBackend(ModelBackend):
+    """Caches the per-request session user lookup (``get_user``)."""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username, password, **kwargs)
+        if user is None and password is not None:
+            # Stop here: ModelBackend, listed after this backend only for
+            # older sessions, would check the same password again
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        if not settings.AUTH_CACHE_TIMEOUT:
+            return super().get_user(user_id)
+
+        cache_key = _user_cache_key(user_id)
+        user = cache.get(cache_key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(cache_key, user, settings.AUTH_CACHE_TIMEOUT)
+        return user
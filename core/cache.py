@@ -0,0 +1,85 @@
+"""
+Per-user versioned caching for the list endpoints.
+
+Each user has a version counter per scope (files, transactions, activity)
+that is bumped on every write to that scope (see core.signals). Cached
+responses and ETags are derived from the current version, so a write
+invalidates them without having to find and delete individual cache keys.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import parse_etags
+from rest_framework.response import Response
+
+FILES = 'files'
+TRANSACTIONS = 'transactions'
+ACTIVITY = 'activity'
+
+
+def _version_key(user_id, scope):
+    return f"version:{scope}:{user_id}"
+
+
+def _new_version():
+    # Time-based so a counter lost to eviction never reuses an old version.
+    return time.time_ns()
+
+
+def get_version(user_id, scope):
+    key = _version_key(user_id, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(user_id, *scopes):
+    """
+    Move ``user_id``'s ``scopes`` to a new version once the current
+    transaction commits (right away outside one). Bumping earlier would let
+    a concurrent reader cache pre-commit rows under the new version.
+    """
+    transaction.on_commit(lambda: _bump(user_id, scopes))
+
+
+def _bump(user_id, scopes):
+    for scope in scopes:
+        key = _version_key(user_id, scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), timeout=None)
+
+
+class VersionedCacheMixin:
+    """
+    Caches a ListAPIView's serialized data per user, version and URL, and
+    answers ``If-None-Match`` with 304 while the version is unchanged.
+    """
+    cache_scope = None
+
+    def list(self, request, *args, **kwargs):
+        user_id = request.user.pk
+        version = get_version(user_id, self.cache_scope)
+        fingerprint = hashlib.md5(
+            f"{self.cache_scope}:{user_id}:{version}:{request.get_host()}:"
+            f"{request.get_full_path()}".encode()
+        ).hexdigest()
+        etag = f'"{fingerprint}"'
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            return Response(status=304, headers=headers)
+
+        cache_key = f"list:{fingerprint}"
+        data = cache.get(cache_key)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            cache.set(cache_key, data, settings.LIST_CACHE_TIMEOUT)
+
+        return Response(data, headers=headers)
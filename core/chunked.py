@@ -0,0 +1,163 @@
+"""
+Resumable chunked uploads.
+
+A client creates an ``UploadSession``, then PUTs consecutive byte ranges of
+the file, each tagged with its offset and a SHA-256 checksum. Chunks are
+spooled and verified, then appended to a staging file, so the server never
+buffers a whole upload, and
+a client that loses its connection asks for the session's offset and resumes
+from there. Plain-text uploads are word-counted as the chunks arrive.
+"""
+import codecs
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+    """A chunk was rejected; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class IncrementalWordCounter:
+    """
+    Counts whitespace-separated words across arbitrary byte boundaries,
+    matching ``len(text.split())`` for the concatenated UTF-8 text.
+    """
+
+    def __init__(self, word_count=0, in_word=False, pending_bytes=b''):
+        self.word_count = word_count
+        self.in_word = in_word
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._decoder.setstate((bytes(pending_bytes), 0))
+
+    @property
+    def pending_bytes(self):
+        return self._decoder.getstate()[0]
+
+    def feed(self, data, final=False):
+        text = self._decoder.decode(data, final)
+        if not text:
+            return
+        words = len(text.split())
+        if words and self.in_word and not text[0].isspace():
+            # The first word continues one counted in the previous chunk.
+            words -= 1
+        self.word_count += words
+        self.in_word = not text[-1].isspace()
+
+
+def staging_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{session.id}.part")
+
+
+def counts_words(session):
+    return os.path.splitext(session.filename)[1].lower() == '.txt'
+
+
+def check_chunk(session, length, offset):
+    """Raise ChunkError unless a ``length``-byte chunk fits at ``offset``."""
+    if offset != session.offset:
+        raise ChunkError(f"Expected offset {session.offset}", status=409)
+    if length <= 0:
+        raise ChunkError("Empty chunk")
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise ChunkError(
+            f"Chunk too large. Maximum chunk size is {settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE} bytes.",
+            status=413,
+        )
+    if offset + length > session.total_size:
+        raise ChunkError("Chunk extends past the declared file size")
+
+
+def spool_chunk(stream, length, checksum):
+    """
+    Read a ``length``-byte chunk body from ``stream`` into a temporary file
+    (in memory up to ``FILE_UPLOAD_MAX_MEMORY_SIZE``) and verify its SHA-256
+    ``checksum``, before any lock is taken: a slow client must not hold the
+    session row, or a database connection, while it sends. Returns the
+    file, rewound; the caller closes it.
+    """
+    digest = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    try:
+        remaining = length
+        while remaining:
+            block = stream.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                raise ChunkError("Chunk body shorter than Content-Length")
+            spooled.write(block)
+            digest.update(block)
+            remaining -= len(block)
+        if digest.hexdigest() != checksum.lower():
+            raise ChunkError("Checksum mismatch")
+    except BaseException:
+        spooled.close()
+        raise
+    spooled.seek(0)
+    return spooled
+
+
+def append_chunk(session, stream, length, offset, checksum=None):
+    """
+    Append ``length`` bytes from ``stream`` at ``offset`` to the session's
+    staging file, verifying the SHA-256 ``checksum`` (hex digest) if given.
+
+    The session row must be locked by the caller; it is updated in memory
+    and saved only once the chunk has been verified.
+    """
+    check_chunk(session, length, offset)
+
+    counter = None
+    if counts_words(session):
+        counter = IncrementalWordCounter(
+            session.word_count, session.in_word, session.pending_bytes
+        )
+
+    digest = hashlib.sha256()
+    path = staging_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as part:
+        # Drop bytes left behind by a chunk that failed half-way through.
+        part.truncate(offset)
+        part.seek(offset)
+        try:
+            remaining = length
+            while remaining:
+                block = stream.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    raise ChunkError("Chunk body shorter than Content-Length")
+                part.write(block)
+                digest.update(block)
+                if counter is not None:
+                    counter.feed(block)
+                remaining -= len(block)
+
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise ChunkError("Checksum mismatch")
+        except ChunkError:
+            part.truncate(offset)
+            raise
+
+    session.offset = offset + length
+    if counter is not None:
+        if session.offset == session.total_size:
+            counter.feed(b'', final=True)
+        session.word_count = counter.word_count
+        session.in_word = counter.in_word
+        session.pending_bytes = counter.pending_bytes
+    session.save(update_fields=['offset', 'word_count', 'in_word', 'pending_bytes', 'updated_at'])
+
+
+def discard_staging_file(session):
+    try:
+        os.remove(staging_path(session))
+    except FileNotFoundError:
+        pass
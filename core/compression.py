@@ -0,0 +1,123 @@
+"""
+Compressed upload storage.
+
+Before an upload is saved, its first ``COMPRESSION_SAMPLE_SIZE`` bytes are
+compressed as a trial; if they shrink by at least
+``UPLOAD_COMPRESSION_MIN_RATIO`` the whole file is stored compressed with
+zstd (when ``zstandard`` is installed) or gzip, under a ``.zst`` / ``.gz``
+suffix, and ``FileUpload.encoding`` records the codec. Already-compressed
+content such as .docx (a zip archive) fails the trial and is stored as is.
+
+``storage.open_upload`` decompresses transparently while streaming;
+``download_file`` sends the stored bytes with ``Content-Encoding`` to
+clients that accept the codec.
+"""
+import gzip
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.files import File
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+SUFFIXES = {GZIP: '.gz', ZSTD: '.zst'}
+
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+BLOCK_SIZE = 64 * 1024
+
+
+def storage_codec():
+    """Codec new uploads are compressed with, or None when disabled."""
+    mode = settings.UPLOAD_COMPRESSION
+    if mode == 'off':
+        return None
+    if mode in ('auto', ZSTD) and zstandard is not None:
+        return ZSTD
+    return GZIP
+
+
+def _compressor(codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=settings.UPLOAD_COMPRESSION_LEVEL_ZSTD).compressobj()
+    # wbits=31 writes a gzip container, readable by gzip.GzipFile and browsers
+    return zlib.compressobj(settings.UPLOAD_COMPRESSION_LEVEL_GZIP, zlib.DEFLATED, 31)
+
+
+def choose_encoding(sample):
+    """Codec to store a file with, judged from a sample of it ('' for raw)."""
+    codec = storage_codec()
+    if codec is None or not sample:
+        return ''
+    compressor = _compressor(codec)
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    return codec if len(sample) / compressed >= settings.UPLOAD_COMPRESSION_MIN_RATIO else ''
+
+
+def prepare_upload(stream, filename):
+    """
+    Return ``(file, encoding)`` to save for the binary ``stream``: the
+    stream itself, or a compressed copy named ``filename`` + codec suffix.
+    """
+    stream.seek(0)
+    sample = stream.read(COMPRESSION_SAMPLE_SIZE)
+    encoding = choose_encoding(sample)
+    stream.seek(0)
+    if not encoding:
+        return File(stream, name=filename), ''
+
+    compressor = _compressor(encoding)
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    while block := stream.read(BLOCK_SIZE):
+        spooled.write(compressor.compress(block))
+    spooled.write(compressor.flush())
+    spooled.seek(0)
+    return File(spooled, name=filename + SUFFIXES[encoding]), encoding
+
+
+class DecodedFile:
+    """Forward-only decompressing reader that also closes the stored file."""
+
+    def __init__(self, raw, encoding):
+        self._raw = raw
+        if encoding == ZSTD:
+            self._reader = zstandard.ZstdDecompressor().stream_reader(raw)
+        else:
+            self._reader = gzip.GzipFile(fileobj=raw, mode='rb')
+
+    def read(self, size=-1):
+        return self._reader.read(size)
+
+    def readable(self):
+        return True
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def accepts_encoding(header, encoding):
+    """
+    Whether an ``Accept-Encoding`` header allows ``encoding``. A coding
+    listed by name takes precedence over ``*`` (RFC 9110, section 12.5.3).
+    """
+    allowed = {}
+    for item in header.split(','):
+        token, _, params = item.partition(';')
+        token = token.strip().lower()
+        if token:
+            allowed.setdefault(token, params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'))
+    return allowed.get(encoding, allowed.get('*', False))
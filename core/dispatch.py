@@ -0,0 +1,170 @@
+"""
+Single entry point for queueing process_file_task.
+
+By default every file goes straight to the Celery queue, so a user who
+uploads thousands of files delays everyone queued behind them. With
+``FILE_DISPATCH_FAIR_SHARE`` on, files wait in the database instead
+(``status='processing'``, ``dispatched_at`` unset) and ``dispatch_pending``
+sends them to the broker only while fewer than ``FILE_DISPATCH_MAX_IN_FLIGHT``
+are queued or running. Each free slot goes to the user with the least work
+in flight per unit of weight (``FILE_DISPATCH_GROUP_WEIGHTS``, by auth
+group), so a light user's file is next in line however long a heavy user's
+backlog is. Files up to ``FILE_DISPATCH_SMALL_FILE_BYTES`` use a separate
+lane with its own slots and Celery queue (``FILE_DISPATCH_PRIORITY_QUEUE``)
+and never wait behind large ones.
+
+Dispatch runs after each upload, after each finished task and from beat,
+one dispatcher at a time (a cache lock): the free slots are counted before
+they are filled, so concurrent dispatchers would overfill them.
+"""
+import heapq
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import FileUpload
+from .tasks import process_file_task, time_limits_for
+
+User = get_user_model()
+
+LOCK_KEY = 'dispatch:lock'
+AGAIN_KEY = 'dispatch:again'
+
+
+def _send(file_upload, countdown=None, queue=None):
+    soft_time_limit, time_limit = time_limits_for(file_upload.size)
+    options = {'queue': queue} if queue else {}
+    process_file_task.apply_async(
+        (file_upload.id,),
+        countdown=countdown or None,
+        soft_time_limit=soft_time_limit,
+        time_limit=time_limit,
+        **options,
+    )
+
+
+def enqueue_file_processing(file_upload, countdown=None):
+    """
+    Queue word counting for ``file_upload``, optionally after ``countdown``
+    seconds, with soft / hard time limits scaled to the file's size. Under
+    fair share the file is left pending instead and ``countdown`` is not
+    needed: it waits for a free slot.
+    """
+    if not settings.FILE_DISPATCH_FAIR_SHARE:
+        # Marked as sent, so turning fair share on later does not send it again
+        FileUpload.objects.filter(id=file_upload.id).update(dispatched_at=timezone.now())
+        _send(file_upload, countdown=countdown)
+        return
+    if file_upload.dispatched_at is not None:
+        # Requeued (e.g. from a dead letter): pending again
+        FileUpload.objects.filter(id=file_upload.id).update(dispatched_at=None)
+        file_upload.dispatched_at = None
+    # Other dispatchers must see the file, and this one's claims must be
+    # visible before its lock is released
+    transaction.on_commit(dispatch_pending)
+
+
+def fair_share_order(backlog, in_flight, weights, slots):
+    """
+    User ids to hand ``slots`` free slots to, one at a time, each to the user
+    with the least work in flight per unit of weight. ``backlog`` maps user
+    id -> pending file count, ordered by each user's oldest pending file,
+    which breaks ties; ``in_flight`` and ``weights`` default to 0 and 1.
+    """
+    heap = [
+        (in_flight.get(user_id, 0) / weights.get(user_id, 1), rank, user_id)
+        for rank, user_id in enumerate(backlog)
+        if backlog[user_id]
+    ]
+    heapq.heapify(heap)
+    remaining = dict(backlog)
+    order = []
+    while heap and len(order) < slots:
+        load, rank, user_id = heapq.heappop(heap)
+        order.append(user_id)
+        remaining[user_id] -= 1
+        if remaining[user_id]:
+            heapq.heappush(heap, (load + 1 / weights.get(user_id, 1), rank, user_id))
+    return order
+
+
+def _lanes():
+    """``(celery queue, file filter, in-flight limit)`` per lane."""
+    if not settings.FILE_DISPATCH_PRIORITY_QUEUE:
+        return [(None, Q(), settings.FILE_DISPATCH_MAX_IN_FLIGHT)]
+    small = settings.FILE_DISPATCH_SMALL_FILE_BYTES
+    return [
+        (settings.FILE_DISPATCH_PRIORITY_QUEUE, Q(size__lte=small),
+         settings.FILE_DISPATCH_PRIORITY_MAX_IN_FLIGHT),
+        (None, Q(size__gt=small) | Q(size__isnull=True), settings.FILE_DISPATCH_MAX_IN_FLIGHT),
+    ]
+
+
+def _weights(user_ids):
+    group_weights = settings.FILE_DISPATCH_GROUP_WEIGHTS
+    if not group_weights:
+        return {}
+    weights = {}
+    memberships = User.groups.through.objects.filter(
+        user_id__in=user_ids, group__name__in=group_weights
+    ).values_list('user_id', 'group__name')
+    for user_id, group in memberships:
+        weights[user_id] = max(weights.get(user_id, 0), group_weights[group])
+    return weights
+
+
+def dispatch_pending():
+    """Send pending files to the broker while slots are free; returns how many."""
+    if not cache.add(LOCK_KEY, 1, settings.FILE_DISPATCH_LOCK_TIMEOUT):
+        # The running dispatcher goes round once more for this call's sake
+        cache.set(AGAIN_KEY, 1, settings.FILE_DISPATCH_LOCK_TIMEOUT)
+        return 0
+    try:
+        dispatched = 0
+        while True:
+            cache.delete(AGAIN_KEY)
+            dispatched += _dispatch_lanes()
+            if not cache.get(AGAIN_KEY):
+                return dispatched
+    finally:
+        cache.delete(LOCK_KEY)
+
+
+def _dispatch_lanes():
+    now = timezone.now()
+    dispatched = 0
+    for queue, lane, limit in _lanes():
+        # Soft-deleted files still occupy a worker until their task exits.
+        # Files dispatched longer ago than the stale window (lost messages)
+        # stop counting so they cannot block the lane.
+        in_flight = dict(
+            FileUpload.all_objects.filter(
+                lane, status='processing',
+                dispatched_at__gte=now - settings.FILE_DISPATCH_STALE_AFTER,
+            ).values_list('user_id').annotate(n=Count('id')).order_by()
+        )
+        slots = limit - sum(in_flight.values())
+        if slots <= 0:
+            continue
+
+        pending = FileUpload.objects.filter(lane, status='processing', dispatched_at__isnull=True)
+        backlog = {
+            row['user_id']: row['n']
+            for row in pending.values('user_id').annotate(n=Count('id'), head=Min('id')).order_by('head')
+        }
+        if not backlog:
+            continue
+
+        shares = Counter(fair_share_order(backlog, in_flight, _weights(list(backlog)), slots))
+        for user_id, count in shares.items():
+            for file_upload in pending.filter(user_id=user_id).order_by('id')[:count]:
+                # Claim only files still pending, should the lock have expired
+                if FileUpload.objects.filter(id=file_upload.id, dispatched_at__isnull=True).update(dispatched_at=now):
+                    _send(file_upload, queue=queue)
+                    dispatched += 1
+    return dispatched
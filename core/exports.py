@@ -0,0 +1,133 @@
+"""
+Streaming CSV / NDJSON exports of PaymentTransaction and ActivityLog.
+
+Rows are read with ``.values_list().iterator(chunk_size=...)`` (a
+server-side cursor on PostgreSQL) and encoded one at a time, so memory use
+does not depend on how many rows are exported. Used by the export endpoint
+and the ``export_records`` management command.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ActivityLog, PaymentTransaction
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class ExportError(ValueError):
+    pass
+
+
+# kind -> (model, columns, timestamp field, field matched by the action filter)
+EXPORTS = {
+    'transactions': (
+        PaymentTransaction,
+        ['id', 'user_id', 'transaction_id', 'amount', 'status', 'timestamp', 'gateway_response'],
+        'timestamp',
+        'status',
+    ),
+    'activity': (
+        ActivityLog,
+        ['id', 'user_id', 'action', 'metadata', 'timestamp'],
+        'timestamp',
+        'action',
+    ),
+}
+
+FORMATS = ('csv', 'ndjson')
+
+
+def parse_bound(value, end=False):
+    """Parse an ISO date or datetime; a bare end date includes that whole day."""
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        parsed = None if day else parse_datetime(value)
+    except ValueError:
+        day = parsed = None
+    if day is not None:
+        if end:
+            day += timedelta(days=1)
+        parsed = datetime.combine(day, time.min)
+    elif parsed is None:
+        raise ExportError(f"Invalid date: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_rows(kind, user=None, start=None, end=None, action=None, exclude=(), using=None):
+    """Return ``(columns, row_iterator)`` for an export, read from database ``using``."""
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export: {kind}")
+    model, columns, date_field, action_field = EXPORTS[kind]
+    columns = [column for column in columns if column not in exclude]
+
+    queryset = model.objects.using(using)
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if start is not None:
+        queryset = queryset.filter(**{f"{date_field}__gte": start})
+    if end is not None:
+        queryset = queryset.filter(**{f"{date_field}__lt": end})
+    if action:
+        queryset = queryset.filter(**{action_field: action})
+
+    rows = queryset.order_by('id').values_list(*columns).iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE
+    )
+    return columns, rows
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'), default=str)
+    if value is None:
+        return ''
+    return str(value)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns).encode()
+    for row in rows:
+        yield writer.writerow([_plain(value) for value in row]).encode()
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record, default=str)
+    return json.dumps(record, separators=(',', ':'), default=str).encode()
+
+
+def iter_ndjson(columns, rows):
+    for row in rows:
+        record = {
+            column: value.isoformat() if isinstance(value, datetime) else value
+            for column, value in zip(columns, row)
+        }
+        yield _dumps(record) + b'\n'
+
+
+def iter_export(fmt, columns, rows):
+    if fmt == 'csv':
+        return iter_csv(columns, rows)
+    if fmt == 'ndjson':
+        return iter_ndjson(columns, rows)
+    raise ExportError(f"Unknown format: {fmt}")
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import FileUpload
+from core.search import index_document
+from core.tasks import count_terms
+
+
+class Command(BaseCommand):
+    help = (
+        "Index processed uploads that have no search entry yet, e.g. files "
+        "completed before full-text search was enabled. Each file is read "
+        "from storage once."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='usernames', default=[],
+            help="Only index files of the given username (may be repeated).",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.SEARCH_INDEX_ENABLED:
+            raise CommandError("SEARCH_INDEX_ENABLED is off.")
+
+        files = FileUpload.objects.filter(
+            status='completed', search_document__isnull=True
+        ).order_by('pk')
+        if options['usernames']:
+            files = files.filter(user__username__in=options['usernames'])
+
+        indexed = failed = 0
+        for file_upload in files.iterator():
+            try:
+                index_document(file_upload, count_terms(file_upload))
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f"File {file_upload.pk}: {exc!r}")
+                continue
+            indexed += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} file(s), {failed} failed."))
@@ -0,0 +1,80 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-request latency with a new database connection per "
+        "request (CONN_MAX_AGE=0) against the configured connection reuse. "
+        "Each simulated request runs the request_started / request_finished "
+        "signals that open and close connections in gunicorn and Celery; "
+        "--path issues real requests through the test client instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--path', help="e.g. /api/queue/ (requests run unauthenticated)")
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        settings_dict = connections[alias].settings_dict
+        configured = settings_dict['CONN_MAX_AGE']
+        pooled = bool(settings_dict.get('OPTIONS', {}).get('pool'))
+
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            if connection.alias == alias:
+                opened.append(1)
+
+        connection_created.connect(count)
+        try:
+            if pooled:
+                # The pool cannot be switched off at runtime; compare with a
+                # run under DB_CONNECTION_MODE=persistent DB_CONN_MAX_AGE=0.
+                modes = [('pool', 0)]
+            else:
+                modes = [('CONN_MAX_AGE=0', 0), (f'CONN_MAX_AGE={configured}', configured)]
+            results = []
+            for mode, max_age in modes:
+                connections[alias].close()
+                settings_dict['CONN_MAX_AGE'] = max_age
+                opened.clear()
+                timings = self._run(alias, options['requests'], options['path'])
+                results.append((mode, timings, len(opened)))
+        finally:
+            settings_dict['CONN_MAX_AGE'] = configured
+            connection_created.disconnect(count)
+
+        baseline = statistics.mean(results[0][1])
+        for mode, timings, connects in results:
+            timings.sort()
+            mean = statistics.mean(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(
+                f"{mode:<20} mean {mean * 1000:7.2f} ms   p95 {p95 * 1000:7.2f} ms   "
+                f"connections opened: {connects:>5}   ({baseline / mean:.1f}x)"
+            )
+
+    def _run(self, alias, requests, path):
+        client = Client() if path else None
+        timings = []
+        for _ in range(requests):
+            start = time.perf_counter()
+            if client is not None:
+                client.get(path)
+            else:
+                request_started.send(sender=self.__class__)
+                with connections[alias].cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+            timings.append(time.perf_counter() - start)
+        return timings
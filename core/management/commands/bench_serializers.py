@@ -0,0 +1,83 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from core.models import ActivityLog, PaymentTransaction
+from core.renderers import ORJSONRenderer
+from core.serializers import (
+    ActivityLogSerializer, ActivityLogValuesSerializer,
+    PaymentTransactionSerializer, PaymentTransactionValuesSerializer,
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare rows/sec of the ModelSerializer list path against the "
+        ".values() + ValuesSerializer + orjson path. Benchmark rows are "
+        "created in a transaction that is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options['rows'], options['repeat'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, rows, repeat):
+        user = get_user_model().objects.create_user(username='bench-serializers')
+        gateway_response = {'pay_status': 'Successful', 'fields': {str(i): 'x' * 40 for i in range(50)}}
+        PaymentTransaction.objects.bulk_create(
+            PaymentTransaction(user=user, transaction_id=f'bench-{i}', amount=100,
+                               status='success', gateway_response=gateway_response)
+            for i in range(rows)
+        )
+        ActivityLog.objects.bulk_create(
+            ActivityLog(user=user, action='file_processed', metadata={'file_id': i, 'word_count': 42})
+            for i in range(rows)
+        )
+
+        cases = [
+            ('transactions', PaymentTransaction.objects.filter(user=user),
+             PaymentTransactionSerializer, PaymentTransactionValuesSerializer, ()),
+            ('transactions, no gateway_response', PaymentTransaction.objects.filter(user=user),
+             PaymentTransactionSerializer, PaymentTransactionValuesSerializer, ('gateway_response',)),
+            ('activity', ActivityLog.objects.filter(user=user),
+             ActivityLogSerializer, ActivityLogValuesSerializer, ()),
+        ]
+        for label, queryset, model_serializer, values_serializer, exclude in cases:
+            def model_path():
+                data = model_serializer(queryset.all(), many=True).data
+                return JSONRenderer().render(data)
+
+            def values_path():
+                serializer = values_serializer(exclude=exclude)
+                data = serializer.serialize(serializer.project(queryset.all()))
+                return ORJSONRenderer().render(data)
+
+            before = self._rows_per_second(model_path, rows, repeat)
+            after = self._rows_per_second(values_path, rows, repeat)
+            self.stdout.write(
+                f"{label:<36} ModelSerializer: {before:>10,.0f} rows/s   "
+                f"values+orjson: {after:>10,.0f} rows/s   ({after / before:.1f}x)"
+            )
+
+    def _rows_per_second(self, func, rows, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return rows / best
@@ -0,0 +1,66 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+TARGETS = {
+    'wsgi': 'import backend.wsgi',
+    'celery': 'import backend.celery; backend.celery.app.loader.import_default_modules()',
+}
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold start of the WSGI application and the Celery app with "
+        "`python -X importtime` in fresh interpreters: wall time, total "
+        "import time and the slowest imports by cumulative time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=sorted(TARGETS), action='append')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15)
+
+    def handle(self, *args, **options):
+        for target in options['target'] or sorted(TARGETS):
+            runs = [self._measure(TARGETS[target]) for _ in range(options['repeat'])]
+            wall = statistics.median(run[0] for run in runs)
+            imports = min(runs, key=lambda run: run[0])[1]
+            total = sum(self_us for self_us, _, _ in imports.values())
+
+            self.stdout.write(
+                f"{target}: median wall {wall * 1000:.0f} ms, "
+                f"import time {total / 1000:.0f} ms, {len(imports)} modules"
+            )
+            slowest = sorted(imports.items(), key=lambda item: item[1][1], reverse=True)
+            # Skip packages that are only slow because of their children
+            shown = 0
+            for module, (self_us, cumulative_us, depth) in slowest:
+                if depth > 2 and cumulative_us < total * 0.01:
+                    continue
+                self.stdout.write(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+                shown += 1
+                if shown == options['top']:
+                    break
+
+    def _measure(self, code):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'))
+        command = [sys.executable, '-X', 'importtime', '-c',
+                   f"import time; t = time.perf_counter(); {code}; "
+                   f"print(time.perf_counter() - t)"]
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        imports = {}
+        for line in result.stderr.splitlines():
+            match = LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, module = match.groups()
+                imports[module] = (int(self_us), int(cumulative_us), len(indent) // 2)
+        return float(result.stdout.strip().splitlines()[-1]), imports
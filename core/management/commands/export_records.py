@@ -0,0 +1,51 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import EXPORTS, FORMATS, ExportError, export_rows, iter_export, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream transactions or activity logs as CSV or NDJSON in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='csv', dest='fmt')
+        parser.add_argument('--start', help="ISO date or datetime (inclusive).")
+        parser.add_argument('--end', help="ISO date (inclusive) or datetime (exclusive).")
+        parser.add_argument('--action', help="ActivityLog action or transaction status.")
+        parser.add_argument('--user', help="Only export rows of this username.")
+        parser.add_argument('--exclude', action='append', default=[], help="Column to leave out.")
+        parser.add_argument('--output', '-o', help="Write to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(username=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        try:
+            columns, rows = export_rows(
+                options['kind'],
+                user=user,
+                start=parse_bound(options['start']),
+                end=parse_bound(options['end'], end=True),
+                action=options['action'],
+                exclude=options['exclude'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            out = open(options['output'], 'wb')
+        else:
+            out = getattr(self.stdout._out, 'buffer', sys.stdout.buffer)
+        try:
+            for chunk in iter_export(options['fmt'], columns, rows):
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
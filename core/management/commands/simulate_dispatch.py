@@ -0,0 +1,136 @@
+import heapq
+import random
+from collections import defaultdict, deque
+
+from django.core.management.base import BaseCommand
+
+from core.dispatch import fair_share_order
+
+HEAVY = 'heavy'
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate file processing while one user floods the queue, and "
+        "compare how long light users wait with plain FIFO dispatch against "
+        "fair-share dispatch (core.dispatch.fair_share_order) with a "
+        "priority lane for small files. No database or broker is used."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--in-flight', type=int, default=4,
+                            help="FILE_DISPATCH_MAX_IN_FLIGHT")
+        parser.add_argument('--priority-in-flight', type=int, default=2,
+                            help="FILE_DISPATCH_PRIORITY_MAX_IN_FLIGHT (0: no priority lane)")
+        parser.add_argument('--small-kb', type=int, default=256,
+                            help="FILE_DISPATCH_SMALL_FILE_BYTES, in KiB")
+        parser.add_argument('--heavy-files', type=int, default=2000)
+        parser.add_argument('--light-users', type=int, default=50)
+        parser.add_argument('--light-files', type=int, default=3, help="per light user")
+        parser.add_argument('--seconds-per-mb', type=float, default=6.0)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        files = self._workload(options)
+        small_bytes = options['small_kb'] * 1024
+        for policy in ('fifo', 'fair-share'):
+            latencies = Simulation(policy, options, small_bytes).run(files)
+            light = sorted(latency for user, latency in latencies if user != HEAVY)
+            heavy = sorted(latency for user, latency in latencies if user == HEAVY)
+            self.stdout.write(
+                f"{policy:<11} light users: p50 {_percentile(light, 50):8.1f}s  "
+                f"p95 {_percentile(light, 95):8.1f}s  p99 {_percentile(light, 99):8.1f}s  "
+                f"max {light[-1]:8.1f}s   heavy user: p50 {_percentile(heavy, 50):8.1f}s  "
+                f"max {heavy[-1]:8.1f}s"
+            )
+
+    def _workload(self, options):
+        """``(arrival, user, size, duration)`` for every file, by arrival."""
+        rng = random.Random(options['seed'])
+
+        def size():
+            # Mostly small text files with a long tail of large ones
+            return int(min(rng.lognormvariate(11.5, 1.5), 50 * 1024 * 1024))
+
+        def duration(nbytes):
+            return 0.2 + nbytes / (1024 * 1024) * options['seconds_per_mb']
+
+        files = []
+        for _ in range(options['heavy_files']):
+            nbytes = size()
+            files.append((0.0, HEAVY, nbytes, duration(nbytes)))
+        # Light users upload while the flood is being worked through
+        horizon = sum(f[3] for f in files) / options['workers'] / 2
+        for user in range(options['light_users']):
+            for _ in range(options['light_files']):
+                nbytes = size()
+                files.append((rng.uniform(0, horizon), user, nbytes, duration(nbytes)))
+        files.sort(key=lambda f: f[0])
+        return files
+
+
+class Simulation:
+    """
+    Discrete-event model of Celery workers. ``fifo`` sends every file to the
+    broker on upload; ``fair-share`` keeps files pending per lane and user and
+    sends one whenever the lane has a free in-flight slot.
+    """
+
+    def __init__(self, policy, options, small_bytes):
+        self.policy = policy
+        self.idle_workers = options['workers']
+        self.small_bytes = small_bytes
+        self.limits = {'default': options['in_flight']}
+        if options['priority_in_flight']:
+            self.limits['priority'] = options['priority_in_flight']
+        self.pending = {lane: defaultdict(deque) for lane in self.limits}
+        self.in_flight = {lane: defaultdict(int) for lane in self.limits}
+        # Workers take priority messages first
+        self.broker = {'priority': deque(), 'default': deque()}
+        self.events = []
+        self.latencies = []
+
+    def run(self, files):
+        for seq, (arrival, user, size, duration) in enumerate(files):
+            heapq.heappush(self.events, (arrival, seq, 'upload', (seq, user, size, duration, arrival)))
+        seq = len(files)
+        while self.events:
+            now, _, kind, item = heapq.heappop(self.events)
+            if kind == 'upload':
+                if self.policy == 'fifo':
+                    self.broker['default'].append(item)
+                else:
+                    self.pending[self._lane(item)][item[1]].append(item)
+            else:
+                lane, item = item
+                self.idle_workers += 1
+                self.latencies.append((item[1], now - item[4]))
+                if self.policy != 'fifo':
+                    self.in_flight[lane][item[1]] -= 1
+            if self.policy != 'fifo':
+                self._dispatch()
+            while self.idle_workers and (self.broker['priority'] or self.broker['default']):
+                lane = 'priority' if self.broker['priority'] else 'default'
+                item = self.broker[lane].popleft()
+                self.idle_workers -= 1
+                seq += 1
+                heapq.heappush(self.events, (now + item[3], seq, 'done', (lane, item)))
+        return self.latencies
+
+    def _lane(self, item):
+        return 'priority' if 'priority' in self.limits and item[2] <= self.small_bytes else 'default'
+
+    def _dispatch(self):
+        for lane, limit in self.limits.items():
+            pending, in_flight = self.pending[lane], self.in_flight[lane]
+            slots = limit - sum(in_flight.values())
+            users = sorted((user for user in pending if pending[user]), key=lambda user: pending[user][0][0])
+            backlog = {user: len(pending[user]) for user in users}
+            for user in fair_share_order(backlog, in_flight, {}, slots):
+                self.broker[lane].append(pending[user].popleft())
+                in_flight[user] += 1
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_rename_created_at_paymenttransaction_timestamp_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='unique_word_count',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='word_sketch',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
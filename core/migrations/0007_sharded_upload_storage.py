@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:59
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_upload_session'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fileupload',
+            name='file',
+            field=models.FileField(upload_to=core.storage.sharded_upload_to),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_list_and_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='fileupload',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('quarantined', 'Quarantined')], default='processing', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_name', models.CharField(max_length=255)),
+                ('task_id', models.CharField(blank=True, max_length=255)),
+                ('args', models.JSONField(blank=True, default=list)),
+                ('reason', models.CharField(max_length=32)),
+                ('exception', models.TextField(blank=True)),
+                ('traceback', models.TextField(blank=True)),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('requeued_at', models.DateTimeField(blank=True, null=True)),
+                ('file_upload', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dead_letters', to='core.fileupload')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:20
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.conf import settings
+from django.db import OperationalError, migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    """GIN index on PostgreSQL, FTS5 table on SQLite; nothing elsewhere."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX core_search_vector_gin ON core_searchdocument USING gin (vector)'
+        )
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                'CREATE VIRTUAL TABLE core_search_fts USING fts5(content, user_id UNINDEXED)'
+            )
+        except OperationalError:
+            # SQLite built without FTS5: core.search uses the ``terms`` column
+            pass
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS core_search_vector_gin')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS core_search_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_task_retries_and_dead_letters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('file_upload', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='core.fileupload')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('terms', models.JSONField(blank=True, default=dict, editable=False)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
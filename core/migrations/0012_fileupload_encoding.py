@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_search_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='encoding',
+            field=models.CharField(blank=True, default='', max_length=8),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:05
+
+from django.db import migrations
+from django.utils import timezone
+
+
+def mark_queued_files_dispatched(apps, schema_editor):
+    """Files already processing were sent to Celery before dispatched_at existed."""
+    FileUpload = apps.get_model('core', 'FileUpload')
+    FileUpload.objects.filter(status='processing', dispatched_at__isnull=True).update(
+        dispatched_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_fileupload_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(mark_queued_files_dispatched, migrations.RunPython.noop),
+    ]
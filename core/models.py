@@ -1,21 +1,67 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
+import os
 import uuid
 
+from .storage import sharded_upload_to
+
 User = get_user_model()
 
+
+class LiveFileUploadManager(models.Manager):
+    """Hides uploads that were soft-deleted and are waiting for the sweeper."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class FileUpload(models.Model):
     STATUS_CHOICES = [
         ('processing', 'Processing'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('quarantined', 'Quarantined'),
     ]
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
-    file = models.FileField(upload_to='uploads/%Y/%m/%d/')
+    file = models.FileField(upload_to=sharded_upload_to)
     filename = models.CharField(max_length=512)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    # Codec the stored blob is compressed with ('' for raw, see core.compression)
+    encoding = models.CharField(max_length=8, blank=True, default='')
     upload_time = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    # Times process_file_task started on this file, counted before parsing so
+    # that crashes and hard time limits are counted too (see tasks.py).
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
+    # When core.dispatch sent the file to Celery; unset while it waits for a
+    # fair-share slot (FILE_DISPATCH_FAIR_SHARE)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
     word_count = models.PositiveIntegerField(null=True, blank=True)
+    # HyperLogLog estimate of distinct words plus the serialized sketch, kept so
+    # per-user vocabularies can be merged without re-reading file contents.
+    unique_word_count = models.PositiveIntegerField(null=True, blank=True)
+    word_sketch = models.BinaryField(null=True, blank=True, editable=False)
+    # Set by the delete endpoints; purge_deleted_files removes the blob and row
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = LiveFileUploadManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-upload_time'], name='core_upload_user_time_idx'),
+            models.Index(fields=['upload_time'], name='core_upload_time_idx'),
+            models.Index(fields=['status', 'upload_time'], name='core_upload_status_time_idx'),
+            models.Index(fields=['status', 'dispatched_at'], name='core_upload_dispatch_idx'),
+            # Admin prefix search (LIKE 'abc%') on PostgreSQL
+            models.Index(fields=['filename'], name='core_upload_filename_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
+    @property
+    def extension(self):
+        return os.path.splitext(self.filename)[1].lower()
 
     def __str__(self):
         return f"{self.filename} ({self.user})"
@@ -34,6 +80,14 @@ class PaymentTransaction(models.Model):
     gateway_response = models.JSONField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='core_tx_user_time_idx'),
+            models.Index(fields=['timestamp'], name='core_tx_time_idx'),
+            models.Index(fields=['transaction_id'], name='core_tx_id_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.transaction_id:
             self.transaction_id = str(uuid.uuid4())
@@ -49,5 +103,115 @@ class ActivityLog(models.Model):
     metadata = models.JSONField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='core_activity_user_time_idx'),
+            models.Index(fields=['timestamp'], name='core_activity_time_idx'),
+            models.Index(fields=['action', 'timestamp'], name='core_activity_action_time_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user} - {self.action} - {self.timestamp}"
+
+
+class UserStats(models.Model):
+    """Running per-user totals, maintained incrementally by core.stats."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    file_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveBigIntegerField(default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    # Union of the per-file vocabulary sketches (see core.hll).
+    word_sketch = models.BinaryField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for {self.user}"
+
+
+class DailyUserStats(models.Model):
+    """Per-user, per-day rollup backing the /api/stats/ time series."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    file_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveBigIntegerField(default=0)
+    payment_count = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_daily_user_stats'),
+        ]
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.user} - {self.date}"
+
+
+class UploadSession(models.Model):
+    """State of a resumable chunked upload (see core.chunked)."""
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('completed', 'Completed'),
+        ('expired', 'Expired'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=512)
+    total_size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    # Incremental word count state for .txt uploads: words seen so far, whether
+    # the last chunk ended inside a word, and any trailing partial UTF-8 bytes.
+    word_count = models.PositiveIntegerField(default=0)
+    in_word = models.BooleanField(default=False)
+    pending_bytes = models.BinaryField(default=b'', blank=True, editable=False)
+    file_upload = models.OneToOneField(
+        FileUpload, on_delete=models.SET_NULL, null=True, blank=True, related_name='upload_session'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.total_size})"
+
+
+class DeadLetter(models.Model):
+    """A task that failed permanently, kept for inspection and requeueing."""
+    task_name = models.CharField(max_length=255)
+    task_id = models.CharField(max_length=255, blank=True)
+    args = models.JSONField(default=list, blank=True)
+    file_upload = models.ForeignKey(
+        FileUpload, on_delete=models.SET_NULL, null=True, blank=True, related_name='dead_letters'
+    )
+    reason = models.CharField(max_length=32)
+    exception = models.TextField(blank=True)
+    traceback = models.TextField(blank=True)
+    retries = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    requeued_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.task_name} ({self.reason}) {self.created_at}"
+
+
+class SearchDocument(models.Model):
+    """
+    Full-text index entry for a processed upload, built by process_file_task
+    from the words it already reads (see core.search). Which column is used
+    depends on the database: ``vector`` on PostgreSQL (GIN-indexed), an FTS5
+    table on SQLite, ``terms`` elsewhere.
+    """
+    file_upload = models.OneToOneField(
+        FileUpload, on_delete=models.CASCADE, primary_key=True, related_name='search_document'
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    vector = SearchVectorField(null=True, editable=False)
+    terms = models.JSONField(default=dict, blank=True, editable=False)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for file {self.file_upload_id}"
@@ -0,0 +1,173 @@
+"""
+Text previews of uploads.
+
+A preview is the first ``PREVIEW_MAX_LINES`` lines of a file, at most
+``PREVIEW_MAX_WORDS`` words in total, built on first request from the start
+of the file only: a .txt is read up to ``PREVIEW_READ_BYTES`` (a ranged GET
+on S3), and a .docx has its ``word/document.xml`` parsed as a stream that
+stops once enough paragraphs are found (on S3 the archive itself is still
+downloaded whole, see ``_docx_preview``). Uploads never change after they are
+stored, so previews are kept per process in a byte-bounded LRU cache and
+never invalidated; smaller previews are slices of the cached one.
+"""
+import codecs
+import threading
+import zipfile
+from collections import OrderedDict
+from xml.etree import ElementTree
+
+from django.conf import settings
+
+from .storage import open_upload, seekable
+
+READ_BLOCK_SIZE = 8 * 1024
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+class LRUCache:
+    """Thread-safe LRU mapping that evicts once values exceed ``max_bytes``."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_previews = LRUCache(settings.PREVIEW_CACHE_BYTES)
+
+
+class _Budget:
+    """Collects lines until the line or word limit is reached."""
+
+    def __init__(self):
+        self.lines = []
+        self.words = 0
+        self.truncated = False
+
+    def add(self, line):
+        """Add ``line``; returns False once there is no room left for it."""
+        room = settings.PREVIEW_MAX_WORDS - self.words
+        if len(self.lines) >= settings.PREVIEW_MAX_LINES or room <= 0:
+            self.truncated = True
+            return False
+        words = line.split()
+        if len(words) > room:
+            # Cut inside the line, keeping its indentation
+            line = line[:len(line) - len(line.lstrip())] + ' '.join(words[:room])
+            self.truncated = True
+        self.lines.append(line.rstrip())
+        self.words += min(len(words), room)
+        return True
+
+
+def _text_preview(file_upload, budget):
+    limit = settings.PREVIEW_READ_BYTES
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    carry = ''
+    read = 0
+    with open_upload(file_upload, length=limit) as f:
+        while read < limit:
+            try:
+                block = f.read(min(READ_BLOCK_SIZE, limit - read))
+            except EOFError:
+                break  # Compressed prefix cut off by the ranged read
+            if not block:
+                break
+            read += len(block)
+            lines = (carry + decoder.decode(block)).split('\n')
+            carry = lines.pop()
+            for line in lines:
+                if not budget.add(line):
+                    return
+    # A compressed prefix can also end early without EOFError (zstd returns
+    # nothing for a cut block), so only a full decoded size is the end
+    if read == file_upload.size:
+        carry += decoder.decode(b'', final=True)
+        if carry:
+            budget.add(carry)
+    else:
+        # The read stopped inside the file: the last line (and possibly a
+        # character) is cut short, so it is left out
+        budget.truncated = True
+
+
+def _docx_preview(file_upload, budget):
+    """
+    Zip archives keep their directory at the end, so the .docx is opened
+    whole: on S3 the entire object is downloaded before parsing starts, and
+    only the parsing stops early.
+    """
+    with open_upload(file_upload) as f, zipfile.ZipFile(seekable(f)) as archive:
+        try:
+            document = archive.open('word/document.xml')
+        except KeyError:
+            raise zipfile.BadZipFile("No word/document.xml in archive") from None
+        with document:
+            texts = []
+            for _, element in ElementTree.iterparse(document, events=('end',)):
+                if element.tag == WORD_NS + 't':
+                    texts.append(element.text or '')
+                elif element.tag == WORD_NS + 'p':
+                    if not budget.add(''.join(texts)):
+                        return
+                    texts = []
+                    # Parsed paragraphs are not needed again
+                    element.clear()
+
+
+def get_preview(file_upload):
+    """
+    ``{'lines': [...], 'words': n, 'truncated': bool}`` for ``file_upload``,
+    from the cache or read from storage.
+    """
+    # Stored names are unique and never reused, unlike ids
+    key = file_upload.file.name
+    preview = _previews.get(key)
+    if preview is None:
+        budget = _Budget()
+        if file_upload.extension == '.docx':
+            _docx_preview(file_upload, budget)
+        else:
+            _text_preview(file_upload, budget)
+        preview = {'lines': budget.lines, 'words': budget.words, 'truncated': budget.truncated}
+        _previews.set(key, preview, sum(len(line.encode()) for line in budget.lines) + 64)
+    return preview
+
+
+def slice_preview(preview, lines=None, words=None):
+    """The first ``lines`` lines / ``words`` words of a cached preview."""
+    result, count = [], 0
+    for line in preview['lines'][:lines]:
+        parts = line.split()
+        if words is not None and count + len(parts) > words:
+            result.append(' '.join(parts[:words - count]))
+            count = words
+            break
+        result.append(line)
+        count += len(parts)
+    truncated = preview['truncated'] or len(result) < len(preview['lines']) or count < preview['words']
+    return {'lines': result, 'words': count, 'truncated': truncated}
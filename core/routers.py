@@ -0,0 +1,79 @@
+"""
+Read replica routing.
+
+Reads run on a replica from ``DATABASE_REPLICAS`` only inside
+``replica_reads()`` blocks (list endpoints, dashboard, admin changelists)
+or on querysets given ``.using(read_database(user))`` (exports, which are
+consumed after the view returns). Everything else, including every write,
+stays on ``default``.
+
+A user's own writes pin their reads to the primary for
+``REPLICA_PIN_SECONDS`` (see signals.py), so e.g. the dashboard shown right
+after ``payment_success`` never lags behind the payment. The pin is kept in
+the shared cache so it holds across web processes and Celery workers.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def _pin_key(user_id):
+    return f"db:pin:{user_id}"
+
+
+def pin_to_primary(user_id):
+    if user_id and settings.DATABASE_REPLICAS:
+        cache.set(_pin_key(user_id), 1, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return bool(user_id) and cache.get(_pin_key(user_id)) is not None
+
+
+def read_database(user=None):
+    """Alias to read ``user``'s data from: a replica unless they wrote recently."""
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas or is_pinned(getattr(user, 'pk', user)):
+        return DEFAULT_DB_ALIAS
+    return random.choice(replicas)
+
+
+@contextmanager
+def replica_reads(user=None):
+    """Send reads made inside the block to ``read_database(user)``."""
+    token = _read_alias.set(read_database(user))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        # Reads inside a transaction on the primary must see its writes
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+
+class ReplicaReadMixin:
+    """Serves a ListAPIView's queries from a replica."""
+
+    def list(self, request, *args, **kwargs):
+        with replica_reads(request.user):
+            return super().list(request, *args, **kwargs)
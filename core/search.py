@@ -0,0 +1,160 @@
+"""
+Full-text search over processed uploads.
+
+process_file_task already reads every word of a file; it hands the word
+frequencies to ``index_document`` so search never re-reads files. A
+document is indexed from its ``SEARCH_MAX_TERMS`` most frequent words, each
+repeated at most ``SEARCH_MAX_TERM_REPEATS`` times, which keeps index rows
+small while still letting frequent words rank higher. Backends, picked
+from the database vendor (or ``SEARCH_BACKEND``):
+
+* ``postgres`` - ``tsvector`` column with a GIN index, ranked by ``ts_rank``
+* ``fts5``     - SQLite FTS5 table ``core_search_fts``, ranked by ``bm25``
+* ``python``   - term frequencies in ``SearchDocument.terms``, scored with
+  TF-IDF over the user's own documents. There is no inverted index: each
+  query checks the terms of every document the user has, so this backend is
+  meant for tests and small development databases only.
+
+Files processed before indexing was enabled are added with
+``manage.py backfill_search_index``.
+"""
+import math
+import string
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Count, F, Q, TextField, Value
+
+from .models import FileUpload, SearchDocument
+
+FTS_TABLE = 'core_search_fts'
+
+_fts_tables = {}
+
+
+def normalize_word(word):
+    return word.strip(string.punctuation).casefold()
+
+
+def _has_fts_table(connection):
+    if connection.alias not in _fts_tables:
+        _fts_tables[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_tables[connection.alias]
+
+
+def search_backend(using=DEFAULT_DB_ALIAS):
+    if settings.SEARCH_BACKEND != 'auto':
+        return settings.SEARCH_BACKEND
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return 'postgres'
+    if connection.vendor == 'sqlite' and _has_fts_table(connection):
+        return 'fts5'
+    return 'python'
+
+
+def _top_terms(counts):
+    limit = settings.SEARCH_MAX_TERMS
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+
+def _index_text(terms):
+    repeats = settings.SEARCH_MAX_TERM_REPEATS
+    return ' '.join(' '.join([term] * min(count, repeats)) for term, count in terms)
+
+
+def index_document(file_upload, counts):
+    """(Re)index ``file_upload`` from a mapping of normalized word -> count."""
+    backend = search_backend()
+    terms = _top_terms(counts)
+    SearchDocument.objects.update_or_create(
+        file_upload=file_upload,
+        defaults={'user_id': file_upload.user_id, 'terms': dict(terms) if backend == 'python' else {}},
+    )
+
+    if backend == 'postgres':
+        SearchDocument.objects.filter(file_upload=file_upload).update(
+            vector=SearchVector(
+                Value(_index_text(terms), output_field=TextField()), config=settings.SEARCH_CONFIG
+            )
+        )
+    elif backend == 'fts5':
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [file_upload.id])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, content, user_id) VALUES (%s, %s, %s)",
+                [file_upload.id, _index_text(terms), file_upload.user_id],
+            )
+
+
+def remove_document(file_id):
+    if search_backend() == 'fts5':
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [file_id])
+
+
+def _query_terms(query):
+    return list(dict.fromkeys(filter(None, (normalize_word(word) for word in query.split()))))
+
+
+def search_files(user, query, using=DEFAULT_DB_ALIAS):
+    """
+    Ranked ``[(file_id, score), ...]`` of ``user``'s live uploads matching
+    every word of ``query``, best first, at most ``SEARCH_MAX_RESULTS``.
+    """
+    terms = _query_terms(query)
+    if not terms:
+        return []
+    limit = settings.SEARCH_MAX_RESULTS
+    backend = search_backend(using)
+
+    if backend == 'postgres':
+        search_query = SearchQuery(' '.join(terms), config=settings.SEARCH_CONFIG, search_type='plain')
+        return list(
+            SearchDocument.objects.using(using)
+            .filter(user=user, vector=search_query, file_upload__deleted_at__isnull=True)
+            .annotate(score=SearchRank(F('vector'), search_query))
+            .order_by('-score', '-file_upload_id')
+            .values_list('file_upload_id', 'score')[:limit]
+        )
+
+    if backend == 'fts5':
+        match = ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+        with connections[using].cursor() as cursor:
+            # bm25() is lower for better matches
+            cursor.execute(
+                f"SELECT rowid, -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND user_id = %s "
+                f"ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT %s",
+                [match, user.pk, limit],
+            )
+            ranked = cursor.fetchall()
+        # FTS5 rows outlive soft deletes until the sweeper purges the upload
+        live = set(
+            FileUpload.objects.using(using)
+            .filter(user=user, id__in=[file_id for file_id, _ in ranked])
+            .values_list('id', flat=True)
+        )
+        return [(file_id, score) for file_id, score in ranked if file_id in live]
+
+    # Matching and document frequencies are worked out by the database; only
+    # the term maps of matching documents are loaded.
+    documents = SearchDocument.objects.using(using).filter(
+        user=user, file_upload__deleted_at__isnull=True
+    )
+    frequencies = documents.aggregate(
+        total=Count('pk'),
+        **{f'df{i}': Count('pk', filter=Q(terms__has_key=term)) for i, term in enumerate(terms)},
+    )
+    idf = {
+        term: math.log(1 + frequencies['total'] / (1 + frequencies[f'df{i}']))
+        for i, term in enumerate(terms)
+    }
+    return sorted(
+        (
+            (file_id, sum((1 + math.log(doc[term])) * idf[term] for term in terms))
+            for file_id, doc in documents.filter(terms__has_keys=terms).values_list('file_upload_id', 'terms')
+        ),
+        key=lambda item: (-item[1], -item[0]),
+    )[:limit]
@@ -1,11 +1,12 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from .models import FileUpload, PaymentTransaction, ActivityLog
 
 class FileUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = FileUpload
-        fields = ['id', 'user', 'file', 'filename', 'upload_time', 'status', 'word_count']
-        read_only_fields = ['user', 'filename', 'upload_time', 'status', 'word_count']
+        fields = ['id', 'user', 'file', 'filename', 'upload_time', 'status', 'word_count', 'unique_word_count']
+        read_only_fields = ['user', 'filename', 'upload_time', 'status', 'word_count', 'unique_word_count']
 
 class PaymentTransactionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -19,3 +20,78 @@ class ActivityLogSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'action', 'metadata', 'timestamp']
         read_only_fields = ['user', 'timestamp']
 
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path for list endpoints. Serializes ``QuerySet.values()``
+    rows into the same representation as ``model_serializer`` without
+    instantiating models or serializer fields per row; the per-field
+    conversion plan is compiled once per (class, excluded fields).
+    """
+    model_serializer = None
+    _plans = {}
+
+    def __init__(self, exclude=(), request=None):
+        self.request = request
+        # ``exclude`` comes from the client: unknown names are dropped so
+        # they cannot add plan cache entries
+        fields = frozenset(self.model_serializer.Meta.fields)
+        exclude = frozenset(exclude) & fields
+        if exclude == fields:
+            # An empty projection would make .values() select every column
+            raise serializers.ValidationError({"exclude": "Cannot exclude every field."})
+        self.plan = self._compile(exclude)
+
+    @classmethod
+    def _compile(cls, exclude):
+        key = (cls, exclude)
+        if key not in cls._plans:
+            plan = []
+            for name, field in cls.model_serializer().fields.items():
+                if name in exclude:
+                    continue
+                if isinstance(field, serializers.FileField):
+                    kind = 'file'
+                elif isinstance(field, (serializers.DateTimeField, serializers.DecimalField)):
+                    kind = field.to_representation
+                else:
+                    kind = None
+                plan.append((name, field.source, kind))
+            cls._plans[key] = plan
+        return cls._plans[key]
+
+    def project(self, queryset):
+        return queryset.values(*[source for _, source, _ in self.plan])
+
+    def _file_url(self, name):
+        url = default_storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request else url
+
+    def to_representation(self, row):
+        data = {}
+        for name, source, kind in self.plan:
+            value = row[source]
+            if value is None or kind is None:
+                data[name] = value
+            elif kind == 'file':
+                data[name] = self._file_url(value) if value else None
+            else:
+                data[name] = kind(value)
+        return data
+
+    def serialize(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
+
+
+class FileUploadValuesSerializer(ValuesSerializer):
+    model_serializer = FileUploadSerializer
+
+
+class PaymentTransactionValuesSerializer(ValuesSerializer):
+    model_serializer = PaymentTransactionSerializer
+
+
+class ActivityLogValuesSerializer(ValuesSerializer):
+    model_serializer = ActivityLogSerializer
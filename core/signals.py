@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user
+from .cache import ACTIVITY, FILES, TRANSACTIONS, bump_version
+from .models import ActivityLog, FileUpload, PaymentTransaction, SearchDocument
+from .routers import pin_to_primary
+from .search import remove_document
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=FileUpload)
+def invalidate_files(sender, instance, **kwargs):
+    bump_version(instance.user_id, FILES)
+    pin_to_primary(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=PaymentTransaction)
+def invalidate_transactions(sender, instance, **kwargs):
+    bump_version(instance.user_id, TRANSACTIONS)
+    pin_to_primary(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=ActivityLog)
+def invalidate_activity(sender, instance, **kwargs):
+    bump_version(instance.user_id, ACTIVITY)
+    pin_to_primary(instance.user_id)
+
+
+# Cached credentials are dropped once the change commits: dropped earlier, a
+# concurrent request could re-read the old row and cache it again.
+
+@receiver([post_save, post_delete], sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which nothing cached depends on
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_cached_user_access(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        user_ids = [instance.pk]
+    elif action == 'pre_clear':
+        # e.g. group.user_set.clear(): find the members before they are gone
+        field = next(f.name for f in sender._meta.fields if f.related_model is type(instance))
+        user_ids = list(sender.objects.filter(**{field: instance}).values_list('user_id', flat=True))
+    else:
+        user_ids = list(pk_set)
+    for user_id in user_ids:
+        transaction.on_commit(lambda user_id=user_id: invalidate_user(user_id))
+
+
+@receiver(post_delete, sender=SearchDocument)
+def remove_search_entry(sender, instance, **kwargs):
+    remove_document(instance.file_upload_id)
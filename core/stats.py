@@ -0,0 +1,154 @@
+"""
+Incrementally maintained per-user rollups (UserStats / DailyUserStats).
+
+Writers call the ``record_*`` helpers right after the event they describe so
+``/api/stats/`` can answer from two small tables instead of scanning every
+upload and transaction. ``rebuild_user_stats`` recomputes a user's rollups
+from the source tables and is used by the ``backfill_stats`` command.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .hll import HyperLogLog, merge_sketches
+from .models import DailyUserStats, FileUpload, PaymentTransaction, UserStats
+
+COUNTER_FIELDS = ('file_count', 'word_count', 'payment_count', 'total_spent')
+
+
+def _bump(user_id, day, **deltas):
+    """Atomically add ``deltas`` to the user's total and daily rows."""
+    updates = {field: F(field) + value for field, value in deltas.items() if value}
+    if not updates:
+        return
+
+    with transaction.atomic():
+        UserStats.objects.get_or_create(user_id=user_id)
+        UserStats.objects.filter(user_id=user_id).update(**updates)
+
+        DailyUserStats.objects.get_or_create(user_id=user_id, date=day)
+        DailyUserStats.objects.filter(user_id=user_id, date=day).update(**updates)
+
+
+def record_upload(file_upload):
+    _bump(file_upload.user_id, timezone.localdate(file_upload.upload_time), file_count=1)
+
+
+def record_words(file_upload):
+    """Add a processed file's word count and vocabulary sketch to the rollups."""
+    _bump(
+        file_upload.user_id,
+        timezone.localdate(file_upload.upload_time),
+        word_count=file_upload.word_count or 0,
+    )
+    if not file_upload.word_sketch:
+        return
+
+    sketch = HyperLogLog.from_bytes(file_upload.word_sketch)
+    with transaction.atomic():
+        stats, _ = UserStats.objects.select_for_update().get_or_create(user_id=file_upload.user_id)
+        if stats.word_sketch:
+            existing = HyperLogLog.from_bytes(stats.word_sketch)
+            if existing.precision == sketch.precision:
+                sketch.merge(existing)
+        stats.word_sketch = sketch.to_bytes()
+        stats.save(update_fields=['word_sketch', 'updated_at'])
+
+
+def record_payment(tx):
+    _bump(
+        tx.user_id,
+        timezone.localdate(tx.timestamp),
+        payment_count=1,
+        total_spent=tx.amount,
+    )
+
+
+def rebuild_user_stats(user):
+    """Recompute a user's rollups from FileUpload and PaymentTransaction."""
+    days = {}
+
+    def day_row(day):
+        return days.setdefault(day, dict.fromkeys(COUNTER_FIELDS, 0))
+
+    # Rollups count every upload made, including ones deleted since
+    uploads = (
+        FileUpload.all_objects.filter(user=user)
+        .annotate(day=TruncDate('upload_time'))
+        .values('day')
+        .annotate(files=Count('id'), words=Sum('word_count'))
+    )
+    for row in uploads:
+        counters = day_row(row['day'])
+        counters['file_count'] = row['files']
+        counters['word_count'] = row['words'] or 0
+
+    payments = (
+        PaymentTransaction.objects.filter(user=user, status='success')
+        .annotate(day=TruncDate('timestamp'))
+        .values('day')
+        .annotate(payments=Count('id'), spent=Sum('amount'))
+    )
+    for row in payments:
+        counters = day_row(row['day'])
+        counters['payment_count'] = row['payments']
+        counters['total_spent'] = row['spent'] or 0
+
+    totals = {
+        field: sum(counters[field] for counters in days.values())
+        for field in COUNTER_FIELDS
+    }
+    sketches = FileUpload.all_objects.filter(
+        user=user, word_sketch__isnull=False
+    ).values_list('word_sketch', flat=True).iterator()
+    sketch = merge_sketches(sketches, settings.WORD_SKETCH_PRECISION)
+
+    with transaction.atomic():
+        UserStats.objects.update_or_create(
+            user=user, defaults={**totals, 'word_sketch': sketch.to_bytes()}
+        )
+        DailyUserStats.objects.filter(user=user).delete()
+        DailyUserStats.objects.bulk_create([
+            DailyUserStats(user=user, date=day, **counters)
+            for day, counters in days.items()
+        ])
+
+
+def user_stats_summary(user, days=30):
+    """Totals plus a zero-filled daily series covering the last ``days`` days."""
+    stats = UserStats.objects.filter(user=user).first()
+    unique_words = 0
+    if stats and stats.word_sketch:
+        unique_words = HyperLogLog.from_bytes(stats.word_sketch).count()
+
+    totals = {
+        'files': stats.file_count if stats else 0,
+        'words': stats.word_count if stats else 0,
+        'unique_words': unique_words,
+        'payments': stats.payment_count if stats else 0,
+        'total_spent': str(stats.total_spent) if stats else '0.00',
+    }
+
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    rows = {
+        row.date: row
+        for row in DailyUserStats.objects.filter(user=user, date__gte=start, date__lte=today)
+    }
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = rows.get(day)
+        series.append({
+            'date': day.isoformat(),
+            'files': row.file_count if row else 0,
+            'words': row.word_count if row else 0,
+            'payments': row.payment_count if row else 0,
+            'spent': str(row.total_spent) if row else '0.00',
+        })
+
+    return {'totals': totals, 'series': series}
@@ -0,0 +1,95 @@
+"""
+Storage helpers for uploaded files.
+
+Uploads are named with a hash prefix (``uploads/ab/cd/<key>.txt``) so no
+single directory or key prefix grows without bound, and are always read
+through the configured Django storage backend (local disk or an
+S3-compatible service, see ``STORAGES`` in settings) instead of
+``FieldFile.path``, so web and worker processes don't need a shared volume.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from django.conf import settings
+
+from .compression import DecodedFile
+
+
+def sharded_upload_to(instance, filename):
+    """``upload_to`` callable spreading uploads over hash-prefixed directories."""
+    stem, extension = os.path.splitext(filename)
+    if extension in ('.gz', '.zst'):
+        # Keep the original extension of compressed uploads: "<key>.txt.gz"
+        extension = os.path.splitext(stem)[1] + extension
+    extension = extension.lower()
+    key = uuid.uuid4().hex
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    width = settings.UPLOAD_SHARD_WIDTH
+    shards = [
+        digest[i * width:(i + 1) * width] for i in range(settings.UPLOAD_SHARD_DEPTH)
+    ]
+    return '/'.join(['uploads', *shards, key + extension])
+
+
+def upload_exists(file_upload):
+    field = file_upload.file
+    return bool(field.name) and field.storage.exists(field.name)
+
+
+def _open_stored(storage, name, length=None):
+    stored = storage.open(name, 'rb')
+    s3_object = getattr(stored, 'obj', None)
+    if s3_object is None:
+        # Local files are read lazily, so only what the caller reads is read
+        return stored
+    # S3 storage files download the whole object into a temporary file on
+    # first read; stream the body of the file's S3 object instead, only its
+    # first ``length`` bytes (a ranged GET) if that is all that is needed.
+    stored.close()
+    params = {} if length is None else {'Range': f'bytes=0-{length - 1}'}
+    return s3_object.get(**params)['Body']
+
+
+def open_upload(file_upload, decode=True, length=None):
+    """
+    Open an upload for streaming binary reads from whichever backend holds
+    it, decompressing it unless ``decode`` is false (see core.compression).
+    With ``length`` only the first ``length`` stored bytes may be read; a
+    decoded prefix can end with EOFError where the stored bytes are cut off.
+    """
+    field = file_upload.file
+    raw = _open_stored(field.storage, field.name, length)
+    if decode and file_upload.encoding:
+        return DecodedFile(raw, file_upload.encoding)
+    return raw
+
+
+def download_url(file_upload, content_type, encoding=None):
+    """
+    A short-lived presigned URL serving the stored bytes of ``file_upload``
+    as an attachment, so S3 downloads skip the web process; None unless
+    ``FILE_DOWNLOAD_REDIRECT`` is on.
+    """
+    if not settings.FILE_DOWNLOAD_REDIRECT:
+        return None
+    field = file_upload.file
+    parameters = {
+        'ResponseContentType': content_type,
+        'ResponseContentDisposition': f'attachment; filename="{file_upload.filename}"',
+    }
+    if encoding:
+        parameters['ResponseContentEncoding'] = encoding
+    return field.storage.url(field.name, parameters=parameters, expire=settings.FILE_DOWNLOAD_URL_EXPIRE)
+
+
+def seekable(stream):
+    """``stream`` if it supports random access, otherwise a spooled copy."""
+    if getattr(stream, 'seekable', lambda: False)():
+        return stream
+    spooled = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    shutil.copyfileobj(stream, spooled, 64 * 1024)
+    spooled.seek(0)
+    return spooled
@@ -1,55 +1,215 @@
-import os
-from celery import shared_task
+import codecs
+import logging
+import math
+from collections import Counter
+from celery import Task, shared_task, states
+from celery.exceptions import SoftTimeLimitExceeded
 from django.conf import settings
-from docx import Document
+from django.core.files.storage import default_storage
+from django.db import InterfaceError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
 
-from .models import FileUpload, ActivityLog
+from .cache import FILES, bump_version
+from .hll import HyperLogLog
+from .chunked import discard_staging_file
+from .models import FileUpload, ActivityLog, DeadLetter, UploadSession
+from .routers import pin_to_primary
+from .search import index_document, normalize_word
+from .stats import record_words
+from .storage import open_upload, seekable
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def process_file_task(file_id):
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def _iter_text_words(stream):
+    """Yield words from a binary UTF-8 stream, one block at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    carry = ""
+    while True:
+        block = stream.read(READ_BLOCK_SIZE)
+        text = carry + decoder.decode(block, final=not block)
+        if not block:
+            yield from text.split()
+            return
+        words = text.split()
+        # A word touching the end of the block may continue in the next one
+        carry = words.pop() if words and not text[-1].isspace() else ""
+        yield from words
+
+
+def _iter_words(file_obj):
+    """Yield the words of a .txt or .docx upload, streamed from storage."""
+    with open_upload(file_obj) as f:
+        if file_obj.extension == ".txt":
+            yield from _iter_text_words(f)
+
+        elif file_obj.extension == ".docx":
+            # python-docx (and lxml) are loaded on first use; Celery workers
+            # import them before forking (backend/celery.py).
+            from docx import Document
+
+            # Zip archives need random access; decompressed streams are
+            # forward-only, so those are spooled first.
+            doc = Document(seekable(f))
+            for paragraph in doc.paragraphs:
+                yield from paragraph.text.split()
+
+
+def count_terms(file_obj):
+    """Normalized word -> count for an upload, as indexed for search."""
+    terms = Counter()
+    for word in _iter_words(file_obj):
+        normalized = normalize_word(word)
+        if normalized:
+            terms[normalized] += 1
+    return terms
+
+
+# Failures worth retrying: storage or database briefly unavailable. Anything
+# else (a corrupt .docx, a missing blob) would fail the same way again.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, OperationalError, InterfaceError)
+
+
+def _give_up(file_obj, status, reason, exc, task_name, task_id=None, retries=0, tb=''):
+    """Mark an upload failed or quarantined and record a DeadLetter for it."""
+    FileUpload.objects.filter(id=file_obj.id).update(status=status)
+    bump_version(file_obj.user_id, FILES)
+    ActivityLog.objects.create(
+        user=file_obj.user,
+        action="file_quarantined" if status == "quarantined" else "file_processing_failed",
+        metadata={"file_id": file_obj.id, "reason": reason, "error": str(exc)}
+    )
+    DeadLetter.objects.create(
+        task_name=task_name,
+        task_id=task_id or '',
+        args=[file_obj.id],
+        file_upload=file_obj,
+        reason=reason,
+        exception=repr(exc),
+        traceback=tb,
+        retries=retries,
+    )
+    logger.warning("Gave up on file %s (%s): %r", file_obj.id, reason, exc)
+
+
+class FileProcessingTask(Task):
     """
-    Reads an uploaded file (.txt or .docx), counts words,
-    updates the FileUpload model, and logs the activity.
+    Retries TRANSIENT_ERRORS with exponential backoff and jitter; once
+    retries run out, or on any other error, the upload is marked failed and
+    the task is recorded as a DeadLetter.
     """
-    try:
-        file_obj = FileUpload.objects.get(id=file_id)
+    autoretry_for = TRANSIENT_ERRORS
+    max_retries = settings.FILE_TASK_MAX_RETRIES
+    retry_backoff = settings.FILE_TASK_RETRY_BACKOFF
+    retry_backoff_max = settings.FILE_TASK_RETRY_BACKOFF_MAX
+    retry_jitter = True
 
-        file_path = file_obj.file.path
-        extension = os.path.splitext(file_path)[1].lower()
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        file_obj = FileUpload.objects.select_related('user').filter(id=args[0]).first()
+        if file_obj is None:
+            return
+        reason = "retries_exhausted" if isinstance(exc, TRANSIENT_ERRORS) else "error"
+        _give_up(file_obj, "failed", reason, exc, self.name, task_id,
+                 retries=self.request.retries, tb=str(einfo))
 
-        word_count = 0
-        if extension == ".txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
-                word_count = len(text.split())
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        # The file's fair-share slot is free again (core.dispatch)
+        if settings.FILE_DISPATCH_FAIR_SHARE and status != states.RETRY:
+            from .dispatch import dispatch_pending
+            dispatch_pending()
 
-        elif extension == ".docx":
-            doc = Document(file_path)
-            text = "\n".join([p.text for p in doc.paragraphs])
-            word_count = len(text.split())
 
-        file_obj.word_count = word_count
-        file_obj.status = "completed"
-        file_obj.save()
+def time_limits_for(size):
+    """Soft and hard time limits (seconds) for parsing a file of ``size`` bytes."""
+    soft = settings.FILE_TASK_SOFT_TIME_LIMIT_BASE
+    soft += (size or 0) / (1024 * 1024) * settings.FILE_TASK_SECONDS_PER_MB
+    soft = min(math.ceil(soft), settings.FILE_TASK_MAX_TIME_LIMIT)
+    return soft, soft + settings.FILE_TASK_HARD_TIME_LIMIT_GRACE
 
-        # Log activity
-        ActivityLog.objects.create(
-            user=file_obj.user,
-            action="file_processed",
-            metadata={"file_id": file_obj.id, "word_count": word_count}
-        )
 
-    except Exception as e:
-        # Mark file as failed
-        FileUpload.objects.filter(id=file_id).update(status="failed")
+@shared_task(bind=True, base=FileProcessingTask)
+def process_file_task(self, file_id):
+    """
+    Reads an uploaded file (.txt or .docx), counts words,
+    updates the FileUpload model, and logs the activity.
+    """
+    file_obj = FileUpload.objects.select_related('user').filter(id=file_id).first()
+    if file_obj is None or file_obj.status != "processing":
+        # Deleted before a worker got to it, quarantined, or a redelivery of
+        # a task that already finished.
+        return
 
-        ActivityLog.objects.create(
-            user=file_obj.user if 'file_obj' in locals() else None,
-            action="file_processing_failed",
-            metadata={"error": str(e)}
+    # Counted before parsing: a worker killed mid-file (out of memory, hard
+    # time limit) never reaches the handlers below, but the redelivered
+    # message sees the attempts it left behind.
+    FileUpload.objects.filter(id=file_id).update(processing_attempts=F('processing_attempts') + 1)
+    attempts = file_obj.processing_attempts + 1
+    if attempts > settings.FILE_TASK_QUARANTINE_AFTER:
+        _give_up(file_obj, "quarantined", "crashed",
+                 f"{attempts - 1} attempts did not finish", self.name, self.request.id,
+                 retries=self.request.retries)
+        return
+
+    try:
+        sketch = None
+        if settings.WORD_SKETCH_ENABLED:
+            sketch = HyperLogLog(settings.WORD_SKETCH_PRECISION)
+        # Word frequencies for the search index, gathered in the same pass
+        terms = Counter() if settings.SEARCH_INDEX_ENABLED else None
+        normalizing = sketch is not None or terms is not None
+
+        word_count = 0
+        for word in _iter_words(file_obj):
+            word_count += 1
+            if normalizing:
+                normalized = normalize_word(word)
+                if normalized:
+                    if sketch is not None:
+                        sketch.add(normalized)
+                    if terms is not None:
+                        terms[normalized] += 1
+    except SoftTimeLimitExceeded as exc:
+        if attempts >= settings.FILE_TASK_QUARANTINE_AFTER or self.request.retries >= self.max_retries:
+            _give_up(file_obj, "quarantined", "time_limit", exc, self.name, self.request.id,
+                     retries=self.request.retries)
+            return
+        raise self.retry(exc=exc, countdown=settings.FILE_TASK_RETRY_BACKOFF)
+    except TRANSIENT_ERRORS:
+        # Not the file's fault, so it does not count towards quarantine
+        FileUpload.objects.filter(id=file_id).update(processing_attempts=F('processing_attempts') - 1)
+        raise
+
+    results = {'word_count': word_count}
+    if sketch is not None:
+        results.update(unique_word_count=sketch.count(), word_sketch=sketch.to_bytes())
+    for field, value in results.items():
+        setattr(file_obj, field, value)
+    # All or nothing: a redelivered task skips completed files, so a file
+    # marked completed must already be indexed and counted. The row is only
+    # completed if it is still live and processing; a file deleted (or
+    # purged) while it was parsed is left alone.
+    with transaction.atomic():
+        completed = FileUpload.objects.filter(id=file_id, status="processing").update(
+            status="completed", processing_attempts=attempts, **results
         )
-        raise e
+        if not completed:
+            return
+        if terms is not None:
+            index_document(file_obj, terms)
+        record_words(file_obj)
+        # update() sends no post_save, so invalidate as signals.py would
+        bump_version(file_obj.user_id, FILES)
+    pin_to_primary(file_obj.user_id)
+
+    # Log activity
+    ActivityLog.objects.create(
+        user=file_obj.user,
+        action="file_processed",
+        metadata={"file_id": file_obj.id, "word_count": word_count}
+    )
 
 
 def process_file_wordcount(file_id):
@@ -59,19 +219,7 @@ def process_file_wordcount(file_id):
     try:
         file_obj = FileUpload.objects.get(id=file_id)
 
-        file_path = file_obj.file.path
-        extension = os.path.splitext(file_path)[1].lower()
-
-        word_count = 0
-        if extension == ".txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                text = f.read()
-                word_count = len(text.split())
-
-        elif extension == ".docx":
-            doc = Document(file_path)
-            text = "\n".join([p.text for p in doc.paragraphs])
-            word_count = len(text.split())
+        word_count = sum(1 for _ in _iter_words(file_obj))
 
         file_obj.word_count = word_count
         file_obj.save()
@@ -86,13 +234,118 @@ def process_file_wordcount(file_id):
     except Exception as e:
         # Mark file as failed
         FileUpload.objects.filter(id=file_id).update(status="failed")
+        if 'file_obj' in locals():
+            bump_version(file_obj.user_id, FILES)
 
-        ActivityLog.objects.create(
-            user=file_obj.user if 'file_obj' in locals() else None,
-            action="file_wordcounting_failed",
-            metadata={"error": str(e)}
-        )
+            ActivityLog.objects.create(
+                user=file_obj.user,
+                action="file_wordcounting_failed",
+                metadata={"file_id": file_obj.id, "error": str(e)}
+            )
         raise e
 
 
+@shared_task
+def dispatch_pending_files():
+    """Fill fair-share slots freed without a dispatch, e.g. by a killed worker."""
+    if not settings.FILE_DISPATCH_FAIR_SHARE:
+        return 0
+    from .dispatch import dispatch_pending
+    return dispatch_pending()
+
+
+@shared_task
+def expire_upload_sessions():
+    """Drop staged chunks of resumable uploads that were abandoned."""
+    cutoff = timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY
+    stale = UploadSession.objects.filter(status='active', updated_at__lt=cutoff)
+    for session in stale.iterator():
+        discard_staging_file(session)
+    return stale.update(status='expired')
+
+
+@shared_task
+def purge_deleted_files(batch_size=None, max_batches=None):
+    """
+    Remove the blobs and rows of soft-deleted uploads, one batch at a time.
+    Rows whose blob could not be removed are kept and retried on the next run.
+    """
+    if batch_size is None:
+        batch_size = settings.FILE_PURGE_BATCH_SIZE
+    if max_batches is None:
+        max_batches = settings.FILE_PURGE_MAX_BATCHES
+
+    purged = 0
+    failed_ids = set()
+    for _ in range(max_batches):
+        batch = list(
+            FileUpload.all_objects.filter(deleted_at__isnull=False)
+            .exclude(id__in=failed_ids)
+            .order_by('id')
+            .values_list('id', 'file')[:batch_size]
+        )
+        if not batch:
+            break
+
+        removed_ids = []
+        for file_id, name in batch:
+            try:
+                if name:
+                    default_storage.delete(name)
+                removed_ids.append(file_id)
+            except Exception:
+                logger.exception("Could not remove blob %s of upload %s", name, file_id)
+                failed_ids.add(file_id)
+
+        FileUpload.all_objects.filter(id__in=removed_ids).delete()
+        purged += len(removed_ids)
+
+    return purged
+
+
+def _walk_storage(path):
+    try:
+        directories, files = default_storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{path}/{name}"
+    for directory in directories:
+        yield from _walk_storage(f"{path}/{directory}")
+
+
+@shared_task
+def collect_orphaned_uploads(grace=None, batch_size=None):
+    """
+    Delete blobs under ``uploads/`` that no FileUpload row refers to, e.g.
+    left behind by a request that failed after saving the file. Blobs newer
+    than the grace period are skipped as their row may not be committed yet.
+    """
+    if grace is None:
+        grace = settings.ORPHAN_UPLOAD_GRACE
+    if batch_size is None:
+        batch_size = settings.FILE_PURGE_BATCH_SIZE
+    cutoff = timezone.now() - grace
+
+    def collect(names):
+        known = set(
+            FileUpload.all_objects.filter(file__in=names).values_list('file', flat=True)
+        )
+        count = 0
+        for name in names:
+            if name in known or default_storage.get_modified_time(name) > cutoff:
+                continue
+            default_storage.delete(name)
+            count += 1
+        return count
 
+    removed = 0
+    names = []
+    for name in _walk_storage("uploads"):
+        names.append(name)
+        if len(names) >= batch_size:
+            removed += collect(names)
+            names = []
+    if names:
+        removed += collect(names)
+    return removed
@@ -1,12 +1,53 @@
+import gzip
+import hashlib
 import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import skipUnless
 from unittest.mock import patch
-from django.test import TestCase
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.utils import timezone
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import Group, Permission, User
 from rest_framework.test import APITestCase
 from rest_framework.authtoken.models import Token
 
-from core.models import PaymentTransaction
+from core.admin import EstimatedCountPaginator
+from core.authentication import CachedModelBackend, CachedTokenAuthentication
+from core.cache import ACTIVITY, get_version
+from core.chunked import IncrementalWordCounter, append_chunk, spool_chunk, staging_path
+from core.hll import HyperLogLog, merge_sketches
+from core.models import (
+    ActivityLog, DailyUserStats, DeadLetter, FileUpload, PaymentTransaction, SearchDocument, UploadSession,
+    UserStats,
+)
+from core.previews import LRUCache, get_preview
+from core.routers import ReplicaRouter, read_database, replica_reads
+from core.search import search_files
+from core.serializers import (
+    ActivityLogSerializer, FileUploadSerializer, PaymentTransactionSerializer, PaymentTransactionValuesSerializer,
+)
+from core.compression import accepts_encoding, prepare_upload, zstandard
+from core.dispatch import LOCK_KEY as DISPATCH_LOCK_KEY, dispatch_pending, enqueue_file_processing, fair_share_order
+from core.storage import open_upload, sharded_upload_to
+from core.throttling import MemoryBucketStore, get_bucket_store
+from core.tasks import collect_orphaned_uploads, process_file_task, purge_deleted_files, time_limits_for
 
 
 class MyEndpointsTest(APITestCase):
@@ -25,7 +66,7 @@ class MyEndpointsTest(APITestCase):
             gateway_response={}
         )
         
-    @patch('core.views.process_file_task.delay')
+    @patch('core.dispatch.process_file_task.apply_async')
     def test_file_upload(self, mock_celery_task):
         file_content = io.BytesIO(b"Sample file content")
         file_content.name = "sample.txt"
@@ -48,3 +89,1257 @@ class MyEndpointsTest(APITestCase):
     def test_activity_list(self):
         response = self.client.get(reverse('activity-list'))
         self.assertEqual(response.status_code, 200)
+
+
+class HyperLogLogTest(TestCase):
+
+    def test_estimate_within_error_bounds(self):
+        sketch = HyperLogLog(precision=12)
+        sketch.update(f"word{i}" for i in range(20000))
+        # Standard error at p=12 is ~1.6%; allow a generous 5%.
+        self.assertAlmostEqual(sketch.count(), 20000, delta=1000)
+
+    def test_merge_matches_union(self):
+        a, b = HyperLogLog(10), HyperLogLog(10)
+        a.update(f"w{i}" for i in range(0, 3000))
+        b.update(f"w{i}" for i in range(2000, 5000))
+        merged = merge_sketches([a.to_bytes(), b.to_bytes(), None], precision=10)
+        self.assertAlmostEqual(merged.count(), 5000, delta=400)
+
+    def test_small_cardinality_is_exact_enough(self):
+        sketch = HyperLogLog()
+        sketch.update(["the", "cat", "the", "hat"])
+        self.assertEqual(sketch.count(), 3)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProcessFileTaskTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="worker", password="testpass")
+
+    def test_counts_words_and_builds_sketch(self):
+        upload = FileUpload.objects.create(
+            user=self.user,
+            file=SimpleUploadedFile("doc.txt", b"The cat saw the other Cat.\nthe end"),
+            filename="doc.txt",
+        )
+        process_file_task(upload.id)
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, "completed")
+        self.assertEqual(upload.word_count, 8)
+        self.assertEqual(upload.unique_word_count, 5)
+
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        response = self.client.get(reverse('vocabulary'))
+        self.assertEqual(response.data["unique_words"], 5)
+        self.assertEqual(response.data["files"], 1)
+
+    def _upload(self, content=b"some words here"):
+        return FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile("doc.txt", content), filename="doc.txt",
+        )
+
+    def test_permanent_failure_is_dead_lettered(self):
+        upload = self._upload()
+        default_storage.delete(upload.file.name)
+
+        result = process_file_task.apply(args=(upload.id,))
+
+        self.assertTrue(result.failed())
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, "failed")
+        letter = DeadLetter.objects.get()
+        self.assertEqual((letter.file_upload_id, letter.reason), (upload.id, "error"))
+        self.assertIn("FileNotFoundError", letter.exception)
+        self.assertTrue(ActivityLog.objects.filter(
+            user=self.user, action="file_processing_failed").exists())
+
+    def test_transient_errors_are_retried_then_dead_lettered(self):
+        upload = self._upload()
+        with patch.object(process_file_task, 'max_retries', 2), \
+                patch('core.tasks._iter_words', side_effect=ConnectionError("storage down")) as mock_iter:
+            process_file_task.apply(args=(upload.id,))
+
+        self.assertEqual(mock_iter.call_count, 3)
+        upload.refresh_from_db()
+        self.assertEqual((upload.status, upload.processing_attempts), ("failed", 0))
+        self.assertEqual(DeadLetter.objects.get().reason, "retries_exhausted")
+
+    def test_files_that_keep_timing_out_or_crashing_are_quarantined(self):
+        upload = self._upload()
+        with patch('core.tasks._iter_words', side_effect=SoftTimeLimitExceeded()) as mock_iter:
+            process_file_task.apply(args=(upload.id,))
+        self.assertEqual(mock_iter.call_count, settings.FILE_TASK_QUARANTINE_AFTER)
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, "quarantined")
+        self.assertEqual(DeadLetter.objects.get().reason, "time_limit")
+
+        # Earlier runs were killed without reporting back
+        crashed = self._upload()
+        FileUpload.objects.filter(id=crashed.id).update(
+            processing_attempts=settings.FILE_TASK_QUARANTINE_AFTER)
+        process_file_task(crashed.id)
+        crashed.refresh_from_db()
+        self.assertEqual(crashed.status, "quarantined")
+
+    def test_file_deleted_while_parsing_stays_deleted(self):
+        for remove in (
+            lambda upload: FileUpload.objects.filter(id=upload.id).update(deleted_at=timezone.now()),
+            lambda upload: FileUpload.all_objects.filter(id=upload.id).delete(),
+        ):
+            upload = self._upload()
+
+            def words(file_obj, upload=upload, remove=remove):
+                yield "some"
+                remove(upload)
+                yield "words"
+
+            with patch('core.tasks._iter_words', side_effect=words):
+                process_file_task(upload.id)
+
+            row = FileUpload.all_objects.filter(id=upload.id).first()
+            self.assertTrue(row is None or (row.deleted_at and row.status == "processing"))
+            self.assertFalse(SearchDocument.objects.filter(file_upload_id=upload.id).exists())
+        self.assertFalse(FileUpload.objects.exists())
+        self.assertFalse(ActivityLog.objects.filter(action="file_processed").exists())
+        self.assertEqual(UserStats.objects.filter(user=self.user, word_count__gt=0).count(), 0)
+
+    def test_time_limits_scale_with_size(self):
+        small, small_hard = time_limits_for(1024)
+        large, large_hard = time_limits_for(50 * 1024 * 1024)
+        self.assertLess(small, large)
+        self.assertLessEqual(large, settings.FILE_TASK_MAX_TIME_LIMIT)
+        self.assertGreater(small_hard, small)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class StatsRollupTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="stats", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def _make_activity(self):
+        tx = PaymentTransaction.objects.create(user=self.user, amount=100, status="initiated")
+        self.client.get(reverse('payment-success'), {'tran_id': tx.transaction_id})
+        # A retried callback must not be counted twice
+        self.client.get(reverse('payment-success'), {'tran_id': tx.transaction_id})
+
+        with patch('core.dispatch.process_file_task.apply_async') as mock_task:
+            upload = io.BytesIO(b"one two three two")
+            upload.name = "words.txt"
+            self.client.post(reverse('file-upload'), {'file': upload})
+            file_id = mock_task.call_args[0][0][0]
+        process_file_task(file_id)
+
+    def test_stats_are_maintained_incrementally(self):
+        self._make_activity()
+
+        response = self.client.get(reverse('stats'), {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        totals = response.data['totals']
+        self.assertEqual(totals['files'], 1)
+        self.assertEqual(totals['words'], 4)
+        self.assertEqual(totals['unique_words'], 3)
+        self.assertEqual(totals['payments'], 1)
+        self.assertEqual(totals['total_spent'], '100.00')
+        self.assertEqual(len(response.data['series']), 7)
+        self.assertEqual(response.data['series'][-1]['files'], 1)
+
+    def test_backfill_matches_incremental_rollups(self):
+        self._make_activity()
+        before = self.client.get(reverse('stats')).data
+
+        UserStats.objects.all().delete()
+        DailyUserStats.objects.all().delete()
+        call_command('backfill_stats', stdout=io.StringIO())
+
+        self.assertEqual(self.client.get(reverse('stats')).data, before)
+
+    def test_late_fail_callback_does_not_undo_a_payment(self):
+        self._make_activity()
+        tx = PaymentTransaction.objects.get(user=self.user)
+        self.client.get(reverse('payment-fail'), {'tran_id': tx.transaction_id})
+        self.client.get(reverse('payment-cancel'), {'tran_id': tx.transaction_id})
+
+        tx.refresh_from_db()
+        self.assertEqual(tx.status, 'success')
+        totals = self.client.get(reverse('stats')).data['totals']
+        self.assertEqual((totals['payments'], totals['total_spent']), (1, '100.00'))
+        self.assertFalse(ActivityLog.objects.filter(action__in=['payment_failed', 'payment_cancelled']).exists())
+
+        UserStats.objects.all().delete()
+        DailyUserStats.objects.all().delete()
+        call_command('backfill_stats', stdout=io.StringIO())
+        self.assertEqual(self.client.get(reverse('stats')).data['totals'], totals)
+
+    def test_vocabulary_is_served_from_the_rollup(self):
+        self.assertEqual(self.client.get(reverse('vocabulary')).data['unique_words'], 0)
+        self._make_activity()
+        FileUpload.objects.update(deleted_at=timezone.now())
+
+        # Token, the rollup row and a file count; no per-file sketches
+        with self.assertNumQueries(3):
+            vocabulary = self.client.get(reverse('vocabulary')).data
+        self.assertEqual(vocabulary['unique_words'], 3)
+        self.assertEqual(vocabulary['unique_words'], self.client.get(reverse('stats')).data['totals']['unique_words'])
+
+
+class IncrementalWordCounterTest(TestCase):
+
+    def test_matches_split_across_any_boundary(self):
+        data = "héllo  wörld\nfoo\tbár baz ".encode("utf-8")
+        for size in (1, 2, 3, 5, 7):
+            counter = IncrementalWordCounter()
+            for start in range(0, len(data), size):
+                counter.feed(data[start:start + size])
+            counter.feed(b'', final=True)
+            self.assertEqual(counter.word_count, 5, f"chunk size {size}")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), CHUNKED_UPLOAD_DIR=tempfile.mkdtemp())
+class ChunkedUploadTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="chunky", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+
+    def _put(self, upload_id, offset, chunk, checksum=None):
+        return self.client.put(
+            reverse('chunked-upload', args=[upload_id]),
+            data=chunk,
+            content_type='application/octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+            HTTP_UPLOAD_CHECKSUM=checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_resumable_upload(self, mock_celery_task):
+        content = b"alpha beta gamma delta epsilon"
+        response = self.client.post(
+            reverse('chunked-upload-init'), {'filename': 'big.txt', 'size': len(content)}
+        )
+        self.assertEqual(response.status_code, 201)
+        upload_id = response.data['upload_id']
+
+        self.assertEqual(self._put(upload_id, 0, content[:8]).data['offset'], 8)
+        # Corrupted chunk is rejected and the offset is not advanced
+        response = self._put(upload_id, 8, content[8:20], checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        # Out-of-order chunk reports where to resume from
+        response = self._put(upload_id, 20, content[20:])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 8)
+
+        status = self.client.get(reverse('chunked-upload', args=[upload_id])).data
+        self.assertEqual(status['offset'], 8)
+        self._put(upload_id, 8, content[8:20])
+        self._put(upload_id, 20, content[20:])
+
+        response = self.client.post(reverse('chunked-upload-complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(mock_celery_task.call_args[0][0], (response.data['file_id'],))
+
+        upload = FileUpload.objects.get(id=response.data['file_id'])
+        self.assertEqual(upload.word_count, 5)
+        with upload.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_complete_requires_all_chunks(self):
+        response = self.client.post(
+            reverse('chunked-upload-init'), {'filename': 'big.txt', 'size': 100}
+        )
+        upload_id = response.data['upload_id']
+        self._put(upload_id, 0, b"x" * 10)
+        response = self.client.post(reverse('chunked-upload-complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 409)
+
+    def test_chunk_is_read_before_the_session_is_locked(self):
+        content = b"one two three four"
+        upload_id = self.client.post(
+            reverse('chunked-upload-init'), {'filename': 'slow.txt', 'size': len(content)}
+        ).data['upload_id']
+
+        def appended_meanwhile(stream, length, checksum):
+            chunk = spool_chunk(stream, length, checksum)
+            # Another request appends the same range while this body arrives
+            UploadSession.objects.filter(id=upload_id).update(offset=8)
+            return chunk
+
+        with patch('core.views.spool_chunk', side_effect=appended_meanwhile), \
+                patch('core.views.append_chunk', wraps=append_chunk) as appended:
+            response = self._put(upload_id, 0, content[:8])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['offset'], 8)
+        # The spooled body is what gets appended, not the request stream
+        self.assertIsInstance(appended.call_args[0][1], tempfile.SpooledTemporaryFile)
+        self.assertFalse(os.path.exists(staging_path(UploadSession.objects.get(id=upload_id))))
+
+    def test_concurrent_complete_keeps_one_file(self):
+        content = b"copied outside the lock"
+        upload_id = self.client.post(
+            reverse('chunked-upload-init'), {'filename': 'race.txt', 'size': len(content)}
+        ).data['upload_id']
+        self._put(upload_id, 0, content)
+
+        def completed_meanwhile(stream, filename):
+            # Another request completes the session while this one copies
+            UploadSession.objects.filter(id=upload_id).update(status='completed')
+            return prepare_upload(stream, filename)
+
+        with patch('core.views.prepare_upload', side_effect=completed_meanwhile), \
+                patch.object(default_storage, 'delete', wraps=default_storage.delete) as deleted:
+            response = self.client.post(reverse('chunked-upload-complete', args=[upload_id]))
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(FileUpload.objects.filter(filename='race.txt').exists())
+        deleted.assert_called_once()
+
+
+class _StubS3Object:
+    """Stands in for a boto3 ``s3.Object``, serving ranged GETs."""
+
+    def __init__(self, content):
+        self.content = content
+        self.ranges = []
+
+    def get(self, Range=None):
+        self.ranges.append(Range)
+        if Range is None:
+            return {'Body': io.BytesIO(self.content)}
+        start, end = map(int, Range.removeprefix('bytes=').split('-'))
+        return {'Body': io.BytesIO(self.content[start:end + 1])}
+
+
+class _StubS3File:
+    def __init__(self, s3_object):
+        self.obj = s3_object
+
+    def read(self, *args):
+        raise AssertionError("the whole object was downloaded")
+
+    def close(self):
+        pass
+
+
+class _StubS3Storage:
+    def __init__(self, s3_object):
+        self.s3_object = s3_object
+
+    def open(self, name, mode='rb'):
+        return _StubS3File(self.s3_object)
+
+    def exists(self, name):
+        return True
+
+    def url(self, name, parameters=None, expire=None):
+        self.signed = (name, parameters, expire)
+        return f"https://s3.example.com/{name}?X-Amz-Signature=stub"
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadStorageTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="storage", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def test_uploads_are_sharded_by_hash_prefix(self):
+        name = sharded_upload_to(None, "Report.TXT")
+        self.assertRegex(name, r"^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.txt$")
+        self.assertNotEqual(name, sharded_upload_to(None, "Report.TXT"))
+
+    def _on_s3(self, upload):
+        with default_storage.open(upload.file.name) as stored:
+            s3_object = _StubS3Object(stored.read())
+        return s3_object, patch.object(FileUpload._meta.get_field('file'), 'storage', _StubS3Storage(s3_object))
+
+    def test_task_streams_the_s3_object_body(self):
+        upload = FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile("s3.txt", b"streamed from the bucket"), filename="s3.txt",
+        )
+        s3_object, on_s3 = self._on_s3(upload)
+        with on_s3:
+            process_file_task(upload.id)
+        upload.refresh_from_db()
+        self.assertEqual(upload.word_count, 4)
+        self.assertEqual(s3_object.ranges, [None])
+
+    @override_settings(FILE_DOWNLOAD_REDIRECT=True, UPLOAD_COMPRESSION='gzip')
+    def test_s3_downloads_redirect_unless_decompressed_here(self):
+        content = b"words worth compressing " * 200
+        stored, encoding = prepare_upload(io.BytesIO(content), "big.txt")
+        upload = FileUpload.objects.create(
+            user=self.user, file=stored, filename="big.txt", size=len(content), encoding=encoding
+        )
+        s3_object, on_s3 = self._on_s3(upload)
+        with on_s3:
+            response = self.client.get(reverse('download-file', args=[upload.id]), HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response.status_code, 302)
+            self.assertTrue(response['Location'].startswith("https://s3.example.com/"))
+            name, parameters, expire = FileUpload._meta.get_field('file').storage.signed
+            self.assertEqual(name, upload.file.name)
+            self.assertEqual(parameters['ResponseContentEncoding'], 'gzip')
+            self.assertIn('big.txt', parameters['ResponseContentDisposition'])
+
+            response = self.client.get(reverse('download-file', args=[upload.id]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), content)
+        self.assertEqual(s3_object.ranges, [None])
+
+    @patch('core.tasks.READ_BLOCK_SIZE', 4)
+    def test_task_streams_from_storage(self):
+        upload = FileUpload.objects.create(
+            user=self.user,
+            file=SimpleUploadedFile("notes.txt", "naïve words split over blocks".encode()),
+            filename="notes.txt",
+        )
+        process_file_task(upload.id)
+        upload.refresh_from_db()
+        self.assertEqual(upload.word_count, 5)
+
+    def test_download_streams_file(self):
+        upload = FileUpload.objects.create(
+            user=self.user,
+            file=SimpleUploadedFile("notes.txt", b"downloadable"),
+            filename="notes.txt",
+        )
+        response = self.client.get(reverse('download-file', args=[upload.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"downloadable")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class BulkDeleteTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="cleaner", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        self.uploads = [
+            FileUpload.objects.create(
+                user=self.user,
+                file=SimpleUploadedFile(f"f{i}.txt", b"content"),
+                filename=f"f{i}.txt",
+            )
+            for i in range(3)
+        ]
+
+    def test_bulk_delete_soft_deletes_then_sweeper_purges(self):
+        other = User.objects.create_user(username="other", password="testpass")
+        foreign = FileUpload.objects.create(
+            user=other, file=SimpleUploadedFile("x.txt", b"x"), filename="x.txt"
+        )
+        ids = [self.uploads[0].id, self.uploads[1].id, foreign.id]
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks, \
+                patch('core.views.purge_deleted_files.delay') as mock_purge:
+            response = self.client.post(reverse('bulk-delete-files'), {'ids': ids}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        # The sweeper is queued after commit
+        self.assertTrue(callbacks)
+        mock_purge.assert_called_once()
+
+        listed = self.client.get(reverse('file-list')).data
+        self.assertEqual([f['id'] for f in listed], [self.uploads[2].id])
+        # Blobs stay until the sweeper runs
+        name = self.uploads[0].file.name
+        self.assertTrue(default_storage.exists(name))
+
+        self.assertEqual(purge_deleted_files(batch_size=1), 2)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(FileUpload.all_objects.filter(id__in=ids).count(), 1)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_orphaned_blobs_are_collected(self):
+        orphan = default_storage.save("uploads/zz/zz/orphan.txt", ContentFile(b"lost"))
+        kept = FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile("kept.txt", b"kept"), filename="kept.txt"
+        ).file.name
+
+        self.assertEqual(collect_orphaned_uploads(grace=timedelta(hours=1)), 0)
+        self.assertEqual(collect_orphaned_uploads(grace=timedelta(0)), 1)
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(kept))
+
+
+class ListCachingTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="poller", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def test_etag_round_trip_and_invalidation(self):
+        first = self.client.get(reverse('activity-list'))
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+
+        not_modified = self.client.get(reverse('activity-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ActivityLog.objects.create(user=self.user, action="something")
+        changed = self.client.get(reverse('activity-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(len(changed.data), 1)
+
+    def test_versions_are_bumped_after_commit(self):
+        before = get_version(self.user.pk, ACTIVITY)
+        with self.captureOnCommitCallbacks(execute=True):
+            ActivityLog.objects.create(user=self.user, action="something")
+            # A reader before the commit must not get a fresh version
+            self.assertEqual(get_version(self.user.pk, ACTIVITY), before)
+        self.assertNotEqual(get_version(self.user.pk, ACTIVITY), before)
+
+    def test_cached_page_skips_serialization_queries(self):
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+        self.client.get(reverse('transaction-list'))
+        # Only the token authentication query remains
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('transaction-list'))
+        self.assertEqual(len(response.data), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class LeanSerializationTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="lean", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def test_values_path_matches_model_serializers(self):
+        FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile("a.txt", b"a b"), filename="a.txt", word_count=2
+        )
+        PaymentTransaction.objects.create(
+            user=self.user, amount="100.50", status="success", gateway_response={"k": [1, 2]}
+        )
+        ActivityLog.objects.create(user=self.user, action="file_uploaded", metadata={"file_id": 1})
+
+        cases = [
+            ('file-list', FileUpload, FileUploadSerializer),
+            ('transaction-list', PaymentTransaction, PaymentTransactionSerializer),
+            ('activity-list', ActivityLog, ActivityLogSerializer),
+        ]
+        for url_name, model, serializer_class in cases:
+            response = self.client.get(reverse(url_name))
+            request = response.wsgi_request
+            expected = serializer_class(
+                model.objects.filter(user=self.user), many=True, context={'request': request}
+            ).data
+            self.assertEqual(json.loads(response.content), json.loads(json.dumps(expected)))
+
+    def test_exclude_drops_gateway_response(self):
+        PaymentTransaction.objects.create(
+            user=self.user, amount=100, status="success", gateway_response={"big": "blob"}
+        )
+        response = self.client.get(reverse('transaction-list'), {'exclude': 'gateway_response'})
+        self.assertNotIn('gateway_response', response.data[0])
+        self.assertEqual(response.data[0]['amount'], '100.00')
+
+    def test_exclude_is_limited_to_known_fields(self):
+        plans = len(PaymentTransactionValuesSerializer._plans)
+        for junk in ('nope', 'nope,also-nope', 'amount,nope'):
+            self.assertEqual(self.client.get(reverse('transaction-list'), {'exclude': junk}).status_code, 200)
+        # Junk names share the plans of the known fields they come with
+        self.assertLessEqual(len(PaymentTransactionValuesSerializer._plans), plans + 2)
+
+        every_field = ','.join(PaymentTransactionSerializer.Meta.fields)
+        response = self.client.get(reverse('transaction-list'), {'exclude': every_field})
+        self.assertEqual(response.status_code, 400)
+
+
+class ExportTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="finance", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        ActivityLog.objects.create(user=self.user, action="file_uploaded", metadata={"file_id": 1})
+        ActivityLog.objects.create(user=self.user, action="file_deleted", metadata={"file_id": 1})
+        other = User.objects.create_user(username="someone", password="testpass")
+        ActivityLog.objects.create(user=other, action="file_uploaded")
+
+    def test_csv_export_streams_own_filtered_rows(self):
+        response = self.client.get(
+            reverse('export', args=['activity']), {'format': 'csv', 'action': 'file_uploaded'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "id,user_id,action,metadata,timestamp")
+        self.assertEqual(len(lines), 2)
+        self.assertIn('"{""file_id"":1}"', lines[1])
+
+    def test_ndjson_export_with_date_range(self):
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+        today = timezone.localdate().isoformat()
+        response = self.client.get(
+            reverse('export', args=['transactions']),
+            {'format': 'ndjson', 'start': today, 'end': today},
+        )
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['amount'], '100.00')
+
+        response = self.client.get(
+            reverse('export', args=['transactions']), {'format': 'ndjson', 'end': '2000-01-01'}
+        )
+        self.assertEqual(b"".join(response.streaming_content), b"")
+
+    def test_management_command_writes_file(self):
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as out:
+            call_command('export_records', 'activity', '--format', 'ndjson', '-o', out.name)
+            self.assertEqual(len(out.read().splitlines()), 3)
+
+
+class AdminChangelistTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username="admin", password="testpass")
+        self.client.force_login(self.admin)
+        customer = User.objects.create_user(username="customer", password="testpass")
+        for i in range(3):
+            PaymentTransaction.objects.create(
+                user=customer, transaction_id=f"abc-{i}", amount=100, status="success"
+            )
+            ActivityLog.objects.create(user=customer, action="payment_success")
+        PaymentTransaction.objects.create(user=self.admin, transaction_id="xyz", amount=100)
+
+    def test_transaction_search_by_prefix_or_username(self):
+        url = reverse('admin:core_paymenttransaction_changelist')
+        response = self.client.get(url, {'q': 'abc-'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+        response = self.client.get(url, {'q': 'admin'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        url = reverse('admin:core_activitylog_changelist')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+
+        for i in range(3):
+            other = User.objects.create_user(username=f"other{i}", password="testpass")
+            ActivityLog.objects.create(user=other, action="payment_success")
+        with CaptureQueriesContext(connection) as after:
+            response = self.client.get(url)
+
+        self.assertEqual(response.context['cl'].result_count, 6)
+        self.assertEqual(len(after), len(before))
+
+
+    def test_large_postgresql_tables_use_the_planner_estimate(self):
+        database = connections['default']
+        queryset = ActivityLog.objects.order_by('id')
+        plan = [{'Plan': {'Plan Rows': settings.ADMIN_ESTIMATED_COUNT_THRESHOLD * 10}}]
+        with patch.object(database, 'vendor', 'postgresql'), patch.object(database, 'cursor') as cursor:
+            db_cursor = cursor.return_value.__enter__.return_value
+            db_cursor.fetchone.return_value = (json.dumps(plan),)
+            count = EstimatedCountPaginator(queryset, 100).count
+
+        self.assertEqual(count, settings.ADMIN_ESTIMATED_COUNT_THRESHOLD * 10)
+        self.assertTrue(db_cursor.execute.call_args[0][0].startswith("EXPLAIN (FORMAT JSON) SELECT"))
+
+
+class RateLimitTest(APITestCase):
+
+    def setUp(self):
+        get_bucket_store().reset()
+        self.user = User.objects.create_user(username="noisy", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def tearDown(self):
+        get_bucket_store().reset()
+
+    def test_token_bucket_refills(self):
+        store = MemoryBucketStore()
+        with patch('core.throttling.time.monotonic', return_value=100.0):
+            self.assertTrue(store.consume('k', 2, 1.0)[0])
+            self.assertTrue(store.consume('k', 2, 1.0)[0])
+            allowed, wait = store.consume('k', 2, 1.0)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 1.0)
+        with patch('core.throttling.time.monotonic', return_value=101.0):
+            self.assertTrue(store.consume('k', 2, 1.0)[0])
+
+    @override_settings(RATE_LIMITS={'upload': {'user': '2/min', 'ip': '100/min'}})
+    def test_upload_returns_429_with_retry_after(self):
+        statuses = [self.client.post(reverse('file-upload')).status_code for _ in range(3)]
+        # Without a payment the first two fail the payment check, not the limiter
+        self.assertEqual(statuses, [403, 403, 429])
+        response = self.client.post(reverse('file-upload'))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '30')
+
+    @override_settings(RATE_LIMITS={'payment_callback': {'ip': '1/min'}})
+    def test_callbacks_are_limited_per_ip(self):
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('payment-fail')).status_code, 302)
+        self.assertEqual(
+            self.client.get(reverse('payment-fail'), REMOTE_ADDR='10.0.0.2').status_code, 302
+        )
+        self.assertEqual(self.client.get(reverse('payment-cancel')).status_code, 429)
+
+    @override_settings(RATE_LIMITS={'payment_callback': {'ip': '1/min'}})
+    def test_spoofed_forwarded_for_shares_a_bucket(self):
+        self.client.credentials()
+        statuses = [
+            self.client.get(reverse('payment-fail'), HTTP_X_FORWARDED_FOR=f"10.9.9.{i}, 203.0.113.7").status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [302, 429, 429])
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(), ADMISSION_MAX_QUEUE_DEPTH=2, ADMISSION_AVG_TASK_SECONDS=10,
+    ADMISSION_WORKER_CONCURRENCY=1,
+)
+class AdmissionControlTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="busy", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+        for i in range(2):
+            FileUpload.objects.create(
+                user=self.user, file=SimpleUploadedFile(f"q{i}.txt", b"x"), filename=f"q{i}.txt"
+            )
+
+    def tearDown(self):
+        # Don't leak a cached "overloaded" queue state into other tests
+        cache.clear()
+
+    def _upload(self):
+        upload = io.BytesIO(b"queued words")
+        upload.name = "late.txt"
+        return self.client.post(reverse('file-upload'), {'file': upload})
+
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_rejects_when_queue_is_full(self, mock_celery_task):
+        response = self._upload()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(response.data['estimated_wait'], 20)
+        mock_celery_task.assert_not_called()
+        self.assertEqual(FileUpload.objects.count(), 2)
+
+        state = self.client.get(reverse('queue-state')).data
+        self.assertEqual(state['depth'], 2)
+        self.assertFalse(state['accepting'])
+
+    @override_settings(ADMISSION_MODE='defer')
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_defer_mode_delays_processing(self, mock_apply_async):
+        response = self._upload()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['estimated_wait'], 20)
+        self.assertEqual(mock_apply_async.call_args.kwargs['countdown'], 20)
+
+    @override_settings(ADMISSION_MODE='defer', ADMISSION_MAX_DEFER=15)
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_defer_mode_rejects_waits_past_the_visibility_timeout(self, mock_apply_async):
+        response = self._upload()
+        self.assertEqual(response.status_code, 503)
+        mock_apply_async.assert_not_called()
+
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_stuck_rows_do_not_block_uploads(self, mock_celery_task):
+        FileUpload.objects.update(upload_time=timezone.now() - timedelta(days=1))
+        self.assertEqual(self._upload().status_code, 201)
+        mock_celery_task.assert_called_once()
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    FILE_DISPATCH_FAIR_SHARE=True, FILE_DISPATCH_MAX_IN_FLIGHT=2,
+    FILE_DISPATCH_PRIORITY_MAX_IN_FLIGHT=1, FILE_DISPATCH_SMALL_FILE_BYTES=1024,
+    ADMISSION_ENABLED=False,
+)
+class FairShareDispatchTest(APITestCase):
+
+    def setUp(self):
+        self.heavy = User.objects.create_user(username="heavy")
+        self.light = User.objects.create_user(username="light")
+        self.backlog = [
+            FileUpload.objects.create(
+                user=self.heavy, file=SimpleUploadedFile(f"h{i}.txt", b"x"), filename=f"h{i}.txt", size=4096
+            )
+            for i in range(5)
+        ]
+
+    def test_slots_go_to_least_loaded_user_by_weight(self):
+        self.assertEqual(fair_share_order({1: 10, 2: 1}, {1: 3}, {}, 2), [2, 1])
+        self.assertEqual(fair_share_order({1: 10, 2: 10}, {}, {2: 2}, 3), [1, 2, 2])
+        self.assertEqual(fair_share_order({1: 1}, {}, {}, 5), [1])
+
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_light_user_is_not_queued_behind_a_flood(self, mock_apply_async):
+        self.assertEqual(dispatch_pending(), 2)
+
+        # Small files take the priority lane, which has a slot free
+        PaymentTransaction.objects.create(user=self.light, amount=100, status="success")
+        self.client.force_authenticate(self.light)
+        upload = io.BytesIO(b"a few words")
+        upload.name = "small.txt"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(reverse('file-upload'), {'file': upload}).status_code, 201)
+        self.assertEqual(mock_apply_async.call_args.kwargs['queue'], settings.FILE_DISPATCH_PRIORITY_QUEUE)
+
+        # A large file waits for a slot, then goes ahead of the heavy backlog
+        large = FileUpload.objects.create(
+            user=self.light, file=SimpleUploadedFile("large.txt", b"x"), filename="large.txt", size=4096
+        )
+        self.assertEqual(dispatch_pending(), 0)
+        FileUpload.objects.filter(id=self.backlog[0].id).update(status='completed')
+        self.assertEqual(dispatch_pending(), 1)
+        self.assertEqual(mock_apply_async.call_args[0][0][0], large.id)
+        self.assertNotIn('queue', mock_apply_async.call_args.kwargs)
+        self.assertEqual(FileUpload.objects.filter(dispatched_at__isnull=True).count(), 3)
+
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_one_dispatcher_at_a_time(self, mock_apply_async):
+        cache.set(DISPATCH_LOCK_KEY, 1)
+        self.assertEqual(dispatch_pending(), 0)
+        mock_apply_async.assert_not_called()
+
+        # The lock holder goes round again for the skipped call
+        def concurrent_dispatch(*args, **kwargs):
+            if mock_apply_async.call_count == 1:
+                self.assertEqual(dispatch_pending(), 0)
+                FileUpload.objects.filter(id=self.backlog[0].id).update(status='completed')
+
+        mock_apply_async.side_effect = concurrent_dispatch
+        cache.delete(DISPATCH_LOCK_KEY)
+        self.assertEqual(dispatch_pending(), 3)
+        self.assertIsNone(cache.get(DISPATCH_LOCK_KEY))
+
+    @override_settings(FILE_DISPATCH_FAIR_SHARE=False)
+    @patch('core.dispatch.process_file_task.apply_async')
+    def test_files_sent_without_fair_share_are_not_sent_again(self, mock_apply_async):
+        enqueue_file_processing(self.backlog[0])
+        with override_settings(FILE_DISPATCH_FAIR_SHARE=True):
+            dispatch_pending()
+        sent = [call[0][0][0] for call in mock_apply_async.call_args_list]
+        self.assertEqual(sent.count(self.backlog[0].id), 1)
+        self.assertEqual(len(sent), 2)
+
+    def test_simulation_bounds_light_user_latency(self):
+        out = io.StringIO()
+        call_command('simulate_dispatch', heavy_files=200, light_users=5, stdout=out)
+        p99 = dict(re.findall(r'^(\S+)\s+light users:.*? p99\s+([\d.]+)s', out.getvalue(), re.MULTILINE))
+        self.assertEqual(set(p99), {'fifo', 'fair-share'})
+        self.assertLess(float(p99['fair-share']), float(p99['fifo']) / 4)
+
+
+class DatabaseConnectionTest(TestCase):
+
+    def test_connections_are_reused_with_health_checks(self):
+        database = connection.settings_dict
+        self.assertEqual(database['CONN_MAX_AGE'], settings.DB_CONN_MAX_AGE)
+        self.assertGreater(database['CONN_MAX_AGE'], 0)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+
+    def test_connection_benchmark_runs(self):
+        out = io.StringIO()
+        call_command('bench_db_connections', requests=5, stdout=out)
+        self.assertIn("CONN_MAX_AGE=0", out.getvalue())
+        self.assertIn(f"CONN_MAX_AGE={settings.DB_CONN_MAX_AGE}", out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRoutingTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="reader", password="testpass")
+        self.other = User.objects.create_user(username="other", password="testpass")
+
+    def test_reads_stick_to_primary_after_own_writes(self):
+        self.assertEqual(read_database(self.user), 'replica1')
+
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+        self.assertEqual(read_database(self.user), 'default')
+        self.assertEqual(read_database(self.other), 'replica1')
+
+    def test_router_only_routes_inside_replica_blocks(self):
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(FileUpload))
+        with replica_reads(self.other):
+            # Inside a transaction reads must see its own writes
+            self.assertIsNone(router.db_for_read(FileUpload))
+            with patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(FileUpload), 'replica1')
+        self.assertEqual(router.db_for_write(FileUpload), 'default')
+
+
+class StartupImportTest(TestCase):
+
+    def test_web_process_does_not_load_document_parser(self):
+        code = "import sys, backend.wsgi; print('docx' in sys.modules, 'lxml.etree' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, '-c', code], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        )
+        self.assertEqual(result.stdout.split(), ['False', 'False'])
+
+
+@override_settings(AUTH_CACHE_TIMEOUT=60)
+class CachedAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="cached", password="testpass")
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_token_lookup_is_cached_until_revoked(self):
+        auth = CachedTokenAuthentication()
+        user, _ = auth.authenticate_credentials(self.token.key)
+        with self.assertNumQueries(0):
+            cached_user, token = auth.authenticate_credentials(self.token.key)
+        self.assertEqual((cached_user, token), (user, self.token))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('token-logout'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get(reverse('queue-state')).status_code, 403)
+
+    def test_rotation_invalidates_old_token(self):
+        self.assertEqual(self.client.get(reverse('queue-state')).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            new_key = self.client.post(reverse('token-rotate')).data['token']
+
+        self.assertEqual(self.client.get(reverse('queue-state')).status_code, 403)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + new_key)
+        self.assertEqual(self.client.get(reverse('queue-state')).status_code, 200)
+
+    def test_session_user_is_cached_and_dropped_on_save(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.pk), self.user)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.is_active = False
+            self.user.save()
+            # Still cached until the save commits
+            self.assertEqual(backend.get_user(self.user.pk), self.user)
+        self.assertTrue(callbacks)
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    def test_group_changes_drop_the_cached_user(self):
+        backend = CachedModelBackend()
+        group = Group.objects.create(name="staff")
+        permission = Permission.objects.get(codename='view_fileupload')
+        group.permissions.add(permission)
+
+        backend.get_user(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        self.assertTrue(backend.get_user(self.user.pk).has_perm('core.view_fileupload'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            group.user_set.clear()
+        self.assertFalse(backend.get_user(self.user.pk).has_perm('core.view_fileupload'))
+
+    def test_sessions_from_the_previous_backend_stay_valid(self):
+        session = self.client.session
+        session[SESSION_KEY] = str(self.user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = self.user.get_session_auth_hash()
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        self.client.credentials()
+        self.assertEqual(self.client.get(reverse('queue-state')).status_code, 200)
+
+    def test_failed_login_checks_the_password_once(self):
+        with patch('django.contrib.auth.base_user.check_password', return_value=False) as check:
+            self.assertFalse(self.client.login(username="cached", password="wrong"))
+        self.assertEqual(check.call_count, 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FileSearchTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="searcher", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+
+    def _processed(self, name, content, user=None):
+        upload = FileUpload.objects.create(
+            user=user or self.user, file=SimpleUploadedFile(name, content), filename=name,
+        )
+        process_file_task(upload.id)
+        return upload
+
+    def _search_and_rank(self):
+        many = self._processed("many.txt", b"cat cat cat dog")
+        once = self._processed("once.txt", b"Cat! and a bird")
+        self._processed("none.txt", b"dog bird")
+        self._processed("other.txt", b"cat cat", user=User.objects.create_user(username="x"))
+        deleted = self._processed("gone.txt", b"cat")
+        FileUpload.objects.filter(id=deleted.id).update(deleted_at=timezone.now())
+        return many, once
+
+    def test_search_is_ranked_scoped_and_paginated(self):
+        many, once = self._search_and_rank()
+
+        response = self.client.get(reverse('file-search'), {'q': 'cat'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([item['id'] for item in response.data['results']], [many.id, once.id])
+        self.assertGreater(response.data['results'][0]['score'], response.data['results'][1]['score'])
+
+        response = self.client.get(reverse('file-search'), {'q': 'cat bird', 'limit': 1})
+        self.assertEqual([item['filename'] for item in response.data['results']], ['once.txt'])
+        self.assertEqual(self.client.get(reverse('file-search')).status_code, 400)
+
+    @override_settings(SEARCH_BACKEND='python')
+    def test_python_fallback_ranks_the_same_way(self):
+        many, once = self._search_and_rank()
+        self.assertEqual(SearchDocument.objects.get(file_upload=many).terms, {'cat': 3, 'dog': 1})
+        self.assertEqual([file_id for file_id, _ in search_files(self.user, 'CAT')], [many.id, once.id])
+
+    def test_failed_indexing_leaves_the_file_processing(self):
+        upload = FileUpload.objects.create(
+            user=self.user, file=SimpleUploadedFile("retry.txt", b"cat dog"), filename="retry.txt",
+        )
+        with patch('core.tasks.index_document', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                process_file_task(upload.id)
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, 'processing')
+        self.assertIsNone(upload.word_count)
+
+        process_file_task(upload.id)
+        self.assertEqual([file_id for file_id, _ in search_files(self.user, 'cat')], [upload.id])
+
+    def test_backfill_indexes_files_completed_before_search(self):
+        with override_settings(SEARCH_INDEX_ENABLED=False):
+            old = self._processed("old.txt", b"cat and dog")
+        self.assertEqual(search_files(self.user, 'cat'), [])
+
+        out = io.StringIO()
+        call_command('backfill_search_index', stdout=out)
+        self.assertIn("Indexed 1 file(s), 0 failed.", out.getvalue())
+        self.assertEqual([file_id for file_id, _ in search_files(self.user, 'cat')], [old.id])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), UPLOAD_COMPRESSION='gzip')
+class CompressedStorageTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_bucket_store().reset()
+        self.user = User.objects.create_user(username="packer", password="testpass")
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + token.key)
+        PaymentTransaction.objects.create(user=self.user, amount=100, status="success")
+
+    def _upload(self, name, content):
+        upload = io.BytesIO(content)
+        upload.name = name
+        with patch('core.dispatch.process_file_task.apply_async') as mock_task:
+            self.client.post(reverse('file-upload'), {'file': upload})
+        return FileUpload.objects.get(id=mock_task.call_args[0][0][0])
+
+    def test_text_is_stored_compressed_and_served_either_way(self):
+        content = b"the quick brown fox jumps over the lazy dog\n" * 500
+        upload = self._upload("fox.txt", content)
+        self.assertEqual(upload.encoding, 'gzip')
+        self.assertTrue(upload.file.name.endswith('.txt.gz'))
+        self.assertLess(default_storage.size(upload.file.name), len(content) // 10)
+
+        process_file_task(upload.id)
+        upload.refresh_from_db()
+        self.assertEqual(upload.word_count, 9 * 500)
+
+        response = self.client.get(reverse('download-file', args=[upload.id]),
+                                   HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), content)
+
+        response = self.client.get(reverse('download-file', args=[upload.id]),
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Length'], str(len(content)))
+        self.assertEqual(b"".join(response.streaming_content), content)
+
+    def test_named_codings_take_precedence_over_the_wildcard(self):
+        self.assertTrue(accepts_encoding('*;q=0, gzip', 'gzip'))
+        self.assertFalse(accepts_encoding('gzip;q=0, *', 'gzip'))
+        self.assertTrue(accepts_encoding('br, *', 'zstd'))
+        self.assertFalse(accepts_encoding('*;q=0', 'gzip'))
+        self.assertFalse(accepts_encoding('br', 'gzip'))
+
+    def test_incompressible_files_are_stored_raw(self):
+        upload = self._upload("noise.txt", os.urandom(4096))
+        self.assertEqual(upload.encoding, '')
+        self.assertTrue(upload.file.name.endswith('.txt'))
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    @override_settings(UPLOAD_COMPRESSION='auto')
+    def test_zstd_is_preferred_when_available(self):
+        content = "লেখা আর শব্দ ".encode() * 1000
+        upload = self._upload("bangla.txt", content)
+        self.assertEqual(upload.encoding, 'zstd')
+        with open_upload(upload) as f:
+            self.assertEqual(f.read(), content)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), UPLOAD_COMPRESSION='gzip', PREVIEW_READ_BYTES=4096)
+class FilePreviewTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="peek", password="testpass")
+        self.client.force_authenticate(self.user)
+
+    def _store(self, name, content):
+        stored, encoding = prepare_upload(io.BytesIO(content), name)
+        return FileUpload.objects.create(
+            user=self.user, file=stored, filename=name, size=len(content), encoding=encoding
+        )
+
+    def test_text_preview_reads_only_a_prefix_and_is_cached(self):
+        content = b"".join(b"line %d of a long log\n" % i for i in range(100000))
+        upload = self._store("log.txt", content)
+        self.assertEqual(upload.encoding, 'gzip')
+
+        with patch('core.previews.open_upload', wraps=open_upload) as opened:
+            response = self.client.get(reverse('file-preview', args=[upload.id]), {'lines': 3})
+            self.assertEqual(response.data['lines'], ["line 0 of a long log", "line 1 of a long log",
+                                                      "line 2 of a long log"])
+            self.assertTrue(response.data['truncated'])
+
+            response = self.client.get(reverse('file-preview', args=[upload.id]), {'words': 8})
+            self.assertEqual(response.data['lines'], ["line 0 of a long log", "line 1"])
+            self.assertEqual(opened.call_count, 1)
+        self.assertEqual(opened.call_args.kwargs['length'], 4096)
+
+        other = User.objects.create_user(username="other")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(reverse('file-preview', args=[upload.id])).status_code, 404)
+
+    @override_settings(PREVIEW_MAX_LINES=2)
+    def test_docx_preview_stops_after_enough_paragraphs(self):
+        from docx import Document
+
+        document = Document()
+        for i in range(500):
+            document.add_paragraph(f"paragraph {i}")
+        buffer = io.BytesIO()
+        document.save(buffer)
+        upload = self._store("report.docx", buffer.getvalue())
+
+        response = self.client.get(reverse('file-preview', args=[upload.id]))
+        self.assertEqual(response.data['lines'], ["paragraph 0", "paragraph 1"])
+        self.assertTrue(response.data['truncated'])
+
+    def _s3_preview(self, name, content, codec):
+        with override_settings(UPLOAD_COMPRESSION=codec):
+            upload = self._store(name, content)
+        with default_storage.open(upload.file.name) as stored:
+            s3_object = _StubS3Object(stored.read())
+        upload.file.storage = _StubS3Storage(s3_object)
+        with override_settings(PREVIEW_MAX_LINES=1000, PREVIEW_MAX_WORDS=10000):
+            return get_preview(upload), s3_object, upload
+
+    def test_s3_preview_uses_a_ranged_get_and_drops_the_cut_line(self):
+        line = "naïve café line\n".encode()
+        content = b"prices\n" + line * 1000
+        preview, s3_object, _ = self._s3_preview("menu.txt", content, 'off')
+        self.assertEqual(s3_object.ranges, ['bytes=0-4095'])
+        self.assertTrue(preview['truncated'])
+        # 4096 bytes end inside a line, halfway through its "ï"
+        self.assertEqual((4096 - 7) % len(line), 3)
+        self.assertEqual(preview['lines'][0], "prices")
+        self.assertEqual(set(preview['lines'][1:]), {"naïve café line"})
+        self.assertEqual(len(preview['lines']), 1 + (4096 - 7) // len(line))
+
+    def test_s3_preview_of_a_compressed_blob_cut_mid_frame_is_truncated(self):
+        # Hex text compresses ~2:1, so 4096 stored bytes end inside the
+        # first compressed block and may decode to nothing at all
+        content = b"".join(hashlib.sha256(b"%d" % i).hexdigest().encode() + b"\n" for i in range(6000))
+        for codec in ['gzip'] + (['zstd'] if zstandard is not None else []):
+            with self.subTest(codec=codec):
+                preview, s3_object, upload = self._s3_preview(f"hashes-{codec}.txt", content, codec)
+                self.assertEqual(upload.encoding, codec)
+                self.assertEqual(s3_object.ranges, ['bytes=0-4095'])
+                self.assertTrue(preview['truncated'])
+                self.assertTrue(all(len(line) == 64 for line in preview['lines']))
+
+    def test_docx_without_document_is_rejected(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('other.xml', '<x/>')
+        upload = self._store("empty.docx", buffer.getvalue())
+        self.assertEqual(self.client.get(reverse('file-preview', args=[upload.id])).status_code, 422)
+
+    def test_lru_cache_is_bounded_by_bytes(self):
+        lru = LRUCache(max_bytes=100)
+        lru.set('a', 'A', 40)
+        lru.set('b', 'B', 40)
+        lru.get('a')
+        lru.set('c', 'C', 40)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), ('A', None, 'C'))
+        lru.set('huge', 'H', 500)
+        self.assertIsNone(lru.get('huge'))
+        self.assertLessEqual(lru.size, 100)
+
+
+class DashboardFragmentTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="historian", password="testpass")
+        FileUpload.objects.bulk_create(
+            FileUpload(user=self.user, file=f"uploads/f{i}.txt", filename=f"old-{i}.txt", status="completed")
+            for i in range(25)
+        )
+
+    def test_shell_renders_without_rows(self):
+        self.client.login(username="historian", password="testpass")
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "old-0.txt")
+        self.assertContains(response, 'data-section="files"')
+
+    def test_sections_are_paginated_and_cached_per_version(self):
+        self.client.force_authenticate(self.user)
+        first = self.client.get(reverse('dashboard-files'), HTTP_ACCEPT='application/json').json()
+        self.assertEqual(first['html'].count("<tr>"), 20)
+        self.assertIn("old-24.txt", first['html'])
+
+        second = self.client.get(first['next'], HTTP_ACCEPT='application/json').json()
+        self.assertEqual(second['html'].count("<tr>"), 5)
+        self.assertIsNone(second['next'])
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse('dashboard-files'), HTTP_ACCEPT='application/json')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FileUpload.objects.create(user=self.user, file="uploads/new.txt", filename="new.txt")
+        fresh = self.client.get(reverse('dashboard-files'), HTTP_ACCEPT='application/json').json()
+        self.assertIn("new.txt", fresh['html'])
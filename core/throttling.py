@@ -0,0 +1,149 @@
+"""
+Token-bucket rate limiting for DRF views.
+
+Each (endpoint scope, user or client IP) pair owns a bucket holding up to
+``N`` tokens that refills at ``N`` per period, as configured by
+``RATE_LIMITS`` (e.g. ``'30/min'``). Buckets live in Redis when
+``RATE_LIMIT_REDIS_URL`` is set, updated by a single Lua script so the check
+is atomic and costs one round trip; otherwise an in-process store is used
+(development and tests).
+"""
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {
+    's': 1, 'sec': 1, 'second': 1,
+    'm': 60, 'min': 60, 'minute': 60,
+    'h': 3600, 'hour': 3600,
+    'd': 86400, 'day': 86400,
+}
+
+
+def parse_rate(rate):
+    """``'30/min'`` -> (capacity 30, refill 0.5 tokens per second)."""
+    count, _, period = rate.partition('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+class MemoryBucketStore:
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return True, 0.0
+            self._buckets[key] = (tokens, now)
+            return False, (1 - tokens) / refill_rate
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBucketStore:
+    # Returns {allowed, seconds to wait}; the wait is a string because Lua
+    # numbers are truncated to integers when returned to the client.
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(wait)}
+"""
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self._script = self._client.register_script(self.SCRIPT)
+
+    def consume(self, key, capacity, refill_rate):
+        allowed, wait = self._script(keys=[key], args=[capacity, refill_rate])
+        return bool(allowed), float(wait)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.RATE_LIMIT_REDIS_URL:
+                    _store = RedisBucketStore(settings.RATE_LIMIT_REDIS_URL)
+                else:
+                    _store = MemoryBucketStore()
+    return _store
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttles one ``RATE_LIMITS`` scope, keyed by user or by client IP."""
+    scope = None
+    key_kind = None
+
+    def get_ident_key(self, request):
+        if self.key_kind == 'user':
+            user = request.user
+            return str(user.pk) if user and user.is_authenticated else None
+        return self.get_ident(request)
+
+    def allow_request(self, request, view):
+        self._wait = 0.0
+        rate = settings.RATE_LIMITS.get(self.scope, {}).get(self.key_kind)
+        ident = self.get_ident_key(request)
+        if not rate or ident is None:
+            return True
+
+        capacity, refill_rate = parse_rate(rate)
+        key = f"throttle:{self.scope}:{self.key_kind}:{ident}"
+        try:
+            allowed, self._wait = get_bucket_store().consume(key, capacity, refill_rate)
+        except Exception:
+            # Fail open: an unavailable limiter must not take the API down.
+            logger.exception("Rate limiter unavailable")
+            return True
+        return allowed
+
+    def wait(self):
+        return math.ceil(self._wait) if self._wait else None
+
+
+def token_bucket_throttles(scope):
+    """Per-user and per-IP throttle classes for a ``RATE_LIMITS`` scope."""
+    return [
+        type(f'{kind.title()}TokenBucketThrottle', (TokenBucketThrottle,), {
+            'scope': scope, 'key_kind': kind,
+        })
+        for kind in ('user', 'ip')
+    ]
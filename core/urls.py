@@ -9,6 +9,8 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('register/', views.register_view, name='register'),
     path('logout/', views.logout_view, name='logout'),
+    path('auth/token/logout/', views.token_logout, name='token-logout'),
+    path('auth/token/rotate/', views.token_rotate, name='token-rotate'),
     
     # API URLs
     path('initiate-payment/', views.initiate_payment, name='initiate-payment'),
@@ -16,12 +18,25 @@ urlpatterns = [
     path('payment/fail/', views.payment_fail, name='payment-fail'),
     path('payment/cancel/', views.payment_cancel, name='payment-cancel'),
     path('upload/', views.UploadFileView.as_view(), name='file-upload'),
+    path('uploads/chunked/', views.ChunkedUploadInitView.as_view(), name='chunked-upload-init'),
+    path('uploads/chunked/<uuid:upload_id>/', views.ChunkedUploadView.as_view(), name='chunked-upload'),
+    path('uploads/chunked/<uuid:upload_id>/complete/', views.ChunkedUploadCompleteView.as_view(), name='chunked-upload-complete'),
     path('files/', views.FileListView.as_view(), name='file-list'),
+    path('files/search/', views.FileSearchView.as_view(), name='file-search'),
+    path('files/<int:file_id>/preview/', views.FilePreviewView.as_view(), name='file-preview'),
+    path('files/bulk-delete/', views.bulk_delete_files, name='bulk-delete-files'),
+    path('vocabulary/', views.VocabularyView.as_view(), name='vocabulary'),
+    path('stats/', views.StatsView.as_view(), name='stats'),
+    path('queue/', views.QueueStateView.as_view(), name='queue-state'),
     path('transactions/', views.TransactionListView.as_view(), name='transaction-list'),
     path('activity/', views.ActivityListView.as_view(), name='activity-list'),
+    path('export/<str:kind>/', views.ExportView.as_view(), name='export'),
     path('download/<int:file_id>/', views.download_file, name='download-file'),
     path('delete/<int:file_id>/', views.delete_file, name='delete-file'),
     
     # Dashboard
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/files/', views.DashboardFilesView.as_view(), name='dashboard-files'),
+    path('dashboard/transactions/', views.DashboardTransactionsView.as_view(), name='dashboard-transactions'),
+    path('dashboard/activity/', views.DashboardActivityView.as_view(), name='dashboard-activity'),
 ]
@@ -1,35 +1,61 @@
+import mimetypes
+import os
 import uuid
-import requests
-import hashlib
+import zipfile
+from xml.etree import ElementTree
+
 from django.conf import settings
-from django.shortcuts import redirect, get_object_or_404
-from rest_framework import status, permissions
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.response import Response
-from .models import PaymentTransaction, FileUpload, ActivityLog
-from .serializers import FileUploadSerializer, PaymentTransactionSerializer, ActivityLogSerializer
-from rest_framework.parsers import MultiPartParser, FormParser
-from .tasks import process_file_task
-from django.utils import timezone
-from rest_framework.views import APIView
-from rest_framework.generics import ListAPIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
-from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
-from django.contrib import messages
+from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
+from django.core.cache import cache
+from django.db import transaction
+from django.http import FileResponse, StreamingHttpResponse
+from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.utils import timezone
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-import os
-from django.http import FileResponse, Http404
-from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_http_methods
-from django.utils.decorators import method_decorator
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-import os
+from rest_framework.authtoken.models import Token
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
+from rest_framework.generics import ListAPIView
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .admission import admission_decision, overloaded_response_data, queue_state, retry_after
+from .cache import ACTIVITY, FILES, TRANSACTIONS, VersionedCacheMixin, bump_version, get_version
+from .chunked import (
+    ChunkError, append_chunk, check_chunk, counts_words, discard_staging_file, spool_chunk, staging_path,
+)
+from .compression import accepts_encoding, prepare_upload
+from .dispatch import enqueue_file_processing
+from .exports import export_rows, iter_export, parse_bound
+from .hll import HyperLogLog
+from .models import PaymentTransaction, FileUpload, ActivityLog, UploadSession, UserStats
+from .previews import get_preview, slice_preview
+from .renderers import CSVRenderer, NDJSONRenderer, ORJSONRenderer
+from .routers import ReplicaReadMixin, read_database, replica_reads
+from .search import search_files
+from .serializers import (
+    ActivityLogSerializer, ActivityLogValuesSerializer, FileUploadSerializer,
+    FileUploadValuesSerializer, PaymentTransactionSerializer, PaymentTransactionValuesSerializer,
+)
+from .stats import record_payment, record_upload, user_stats_summary
+from .storage import download_url, open_upload, upload_exists
+from .tasks import purge_deleted_files
+from .throttling import token_bucket_throttles
+
+ALLOWED_EXTENSIONS = ['.txt', '.docx']
+
+
+def overloaded_response(state):
+    """503 returned by admission control while the processing queue is full."""
+    return Response(
+        overloaded_response_data(state), status=503, headers={'Retry-After': retry_after(state)}
+    )
 
 
 class UploadFileView(APIView):
@@ -38,6 +64,7 @@ class UploadFileView(APIView):
     Triggers Celery task for word count.
     """
     permission_classes = [IsAuthenticated]
+    throttle_classes = token_bucket_throttles('upload')
     parser_classes = (MultiPartParser, FormParser)
 
     def post(self, request, *args, **kwargs):
@@ -51,11 +78,10 @@ class UploadFileView(APIView):
             return Response({"error": "No file provided"}, status=400)
         
         # Check file extension
-        allowed_extensions = ['.txt', '.docx']
         file_extension = os.path.splitext(uploaded_file.name)[1].lower()
-        if file_extension not in allowed_extensions:
+        if file_extension not in ALLOWED_EXTENSIONS:
             return Response({
-                "error": f"Invalid file type. Only {', '.join(allowed_extensions)} files are allowed."
+                "error": f"Invalid file type. Only {', '.join(ALLOWED_EXTENSIONS)} files are allowed."
             }, status=400)
         
         # Check file size (10MB limit)
@@ -65,16 +91,26 @@ class UploadFileView(APIView):
                 "error": f"File too large. Maximum size is {max_size // (1024*1024)}MB."
             }, status=400)
 
+        admit, countdown, state = admission_decision()
+        if not admit:
+            return overloaded_response(state)
+
         serializer = FileUploadSerializer(data=request.data)
         if serializer.is_valid():
+            stored, encoding = prepare_upload(uploaded_file, uploaded_file.name)
             file_upload = serializer.save(
                 user=request.user, 
                 status="processing",
-                filename=uploaded_file.name
+                filename=uploaded_file.name,
+                size=uploaded_file.size,
+                file=stored,
+                encoding=encoding
             )
 
+            record_upload(file_upload)
+
             # Trigger Celery task for word count
-            process_file_task.delay(file_upload.id)
+            enqueue_file_processing(file_upload, countdown=countdown)
 
             # Log activity
             ActivityLog.objects.create(
@@ -83,39 +119,463 @@ class UploadFileView(APIView):
                 metadata={"file_id": file_upload.id, "filename": file_upload.filename}
             )
 
+            if countdown:
+                return Response({
+                    "message": "File uploaded; processing is deferred while the queue is busy.",
+                    "estimated_wait": countdown,
+                }, status=201)
             return Response({"message": "File uploaded and processing started."}, status=201)
         return Response(serializer.errors, status=400)
 
 
-class FileListView(ListAPIView):
+class ChunkedUploadInitView(APIView):
+    """
+    Start a resumable upload (POST /api/uploads/chunked/ with filename and size).
+    The file is then sent with PUT requests to the returned upload URL.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = token_bucket_throttles('upload')
+
+    def post(self, request, *args, **kwargs):
+        if not PaymentTransaction.objects.filter(user=request.user, status="success").exists():
+            return Response({"error": "Payment required before upload."}, status=403)
+
+        filename = os.path.basename(str(request.data.get('filename', '')))
+        if not filename:
+            return Response({"error": "No filename provided"}, status=400)
+
+        file_extension = os.path.splitext(filename)[1].lower()
+        if file_extension not in ALLOWED_EXTENSIONS:
+            return Response({
+                "error": f"Invalid file type. Only {', '.join(ALLOWED_EXTENSIONS)} files are allowed."
+            }, status=400)
+
+        try:
+            total_size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({"error": "size must be an integer"}, status=400)
+        max_size = settings.CHUNKED_UPLOAD_MAX_SIZE
+        if not 0 < total_size <= max_size:
+            return Response({
+                "error": f"File size must be between 1 byte and {max_size // (1024*1024)}MB."
+            }, status=400)
+
+        # Refuse before the client spends time sending chunks
+        admit, _, state = admission_decision()
+        if not admit:
+            return overloaded_response(state)
+
+        session = UploadSession.objects.create(
+            user=request.user, filename=filename, total_size=total_size
+        )
+        return Response({
+            "upload_id": str(session.id),
+            "offset": 0,
+            "max_chunk_size": settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE,
+        }, status=201)
+
+
+class ChunkedUploadView(APIView):
+    """
+    GET returns the acknowledged offset to resume from.
+    PUT appends the raw request body at the ``Upload-Offset`` header, checked
+    against the SHA-256 hex digest in the ``Upload-Checksum`` header.
+    """
+    permission_classes = [IsAuthenticated]
+    throttle_classes = token_bucket_throttles('upload_chunk')
+
+    def get(self, request, upload_id, *args, **kwargs):
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        return Response({
+            "upload_id": str(session.id),
+            "status": session.status,
+            "offset": session.offset,
+            "size": session.total_size,
+        })
+
+    def put(self, request, upload_id, *args, **kwargs):
+        try:
+            offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({"error": "Upload-Offset header is required"}, status=400)
+        checksum = request.META.get('HTTP_UPLOAD_CHECKSUM')
+        if not checksum:
+            return Response({"error": "Upload-Checksum header is required"}, status=400)
+
+        # The body is read before the session row is locked, so a slow client
+        # holds neither a transaction nor a pooled connection
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        if session.status != 'active':
+            return Response({"error": f"Upload is {session.status}"}, status=409)
+        try:
+            check_chunk(session, length, offset)
+            chunk = spool_chunk(request.stream, length, checksum)
+        except ChunkError as e:
+            return Response({"error": str(e), "offset": session.offset}, status=e.status)
+
+        with chunk, transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(), id=upload_id, user=request.user
+            )
+            if session.status != 'active':
+                return Response({"error": f"Upload is {session.status}"}, status=409)
+            try:
+                # Rechecks the offset: another request may have appended meanwhile
+                append_chunk(session, chunk, length, offset)
+            except ChunkError as e:
+                return Response({"error": str(e), "offset": session.offset}, status=e.status)
+
+        return Response({"offset": session.offset, "size": session.total_size})
+
+
+def _not_completable(session):
+    """409 response if ``session`` cannot be completed now, else None."""
+    if session.status != 'active':
+        return Response({"error": f"Upload is {session.status}"}, status=409)
+    if session.offset != session.total_size:
+        return Response({
+            "error": "Upload is incomplete",
+            "offset": session.offset,
+            "size": session.total_size,
+        }, status=409)
+    return None
+
+
+class ChunkedUploadCompleteView(APIView):
+    """Finish a chunked upload and start processing (POST .../complete/)."""
+    permission_classes = [IsAuthenticated]
+    throttle_classes = token_bucket_throttles('upload')
+
+    def post(self, request, upload_id, *args, **kwargs):
+        admit, countdown, state = admission_decision()
+        if not admit:
+            return overloaded_response(state)
+
+        session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+        error = _not_completable(session)
+        if error:
+            return error
+
+        file_upload = FileUpload(
+            user=request.user,
+            filename=session.filename,
+            size=session.total_size,
+            status="processing",
+            # Provisional count from the chunks; the task recomputes it
+            word_count=session.word_count if counts_words(session) else None,
+        )
+        # Copy (and compress) the staged file without holding the session
+        # lock, so chunk requests for this upload are not blocked meanwhile
+        with open(staging_path(session), 'rb') as staged:
+            stored, file_upload.encoding = prepare_upload(staged, session.filename)
+            file_upload.file.save(stored.name, stored, save=False)
+
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(id=session.id)
+            error = _not_completable(session)
+            if error is None:
+                file_upload.save()
+                session.status = 'completed'
+                session.file_upload = file_upload
+                session.save(update_fields=['status', 'file_upload', 'updated_at'])
+        if error:
+            # A concurrent request completed (or expired) the upload first
+            file_upload.file.delete(save=False)
+            return error
+
+        discard_staging_file(session)
+        record_upload(file_upload)
+
+        # Trigger Celery task for word count
+        enqueue_file_processing(file_upload, countdown=countdown)
+
+        ActivityLog.objects.create(
+            user=request.user,
+            action="file_uploaded",
+            metadata={"file_id": file_upload.id, "filename": file_upload.filename, "chunked": True}
+        )
+
+        return Response({
+            "message": "File uploaded and processing started.",
+            "file_id": file_upload.id,
+            "estimated_wait": countdown or 0,
+        }, status=201)
+
+
+class ValuesListMixin:
+    """
+    Lists through a ValuesSerializer projection instead of the model
+    serializer. ``?exclude=a,b`` drops fields (e.g. ``gateway_response``)
+    from both the SELECT and the output.
+    """
+    values_serializer_class = None
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        exclude = [name for name in request.query_params.get('exclude', '').split(',') if name]
+        serializer = self.values_serializer_class(exclude=exclude, request=request)
+        queryset = serializer.project(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+
+class RenderedRowsMixin:
+    """
+    Lists a page as table rows rendered with ``row_template`` for the
+    dashboard, which inserts them as they are.
+    """
+    row_template = None
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(render_to_string(self.row_template, {'rows': page}))
+
+
+class DashboardPagination(CursorPagination):
+    """
+    Keyset pages (``?cursor=``), so deep pages cost the same as the first
+    and no COUNT(*) is run. Ordering and page size come from the view.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = view.ordering
+        self.page_size = view.page_size
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'previous': self.get_previous_link(), 'html': data})
+
+
+class QueueStateView(APIView):
+    """Processing backlog as seen by admission control (GET /api/queue/)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(queue_state())
+
+
+class FileListView(VersionedCacheMixin, ReplicaReadMixin, ValuesListMixin, ListAPIView):
     """List uploaded files for the authenticated user."""
     permission_classes = [IsAuthenticated]
     serializer_class = FileUploadSerializer
+    cache_scope = FILES
+    values_serializer_class = FileUploadValuesSerializer
 
     def get_queryset(self):
         return FileUpload.objects.filter(user=self.request.user)
 
 
-class TransactionListView(ListAPIView):
+class SearchPagination(LimitOffsetPagination):
+    default_limit = 20
+    max_limit = 100
+
+
+class FileSearchView(APIView):
+    """
+    Ranked full-text search over the authenticated user's processed files
+    (GET /api/files/search/?q=words&limit=&offset=). Every word must match.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({"error": "q is required"}, status=400)
+
+        using = read_database(request.user)
+        ranked = search_files(request.user, query, using=using)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(ranked, request, view=self)
+
+        serializer = FileUploadValuesSerializer(request=request)
+        rows = serializer.project(
+            FileUpload.objects.using(using).filter(id__in=[file_id for file_id, _ in page])
+        )
+        files = {item['id']: item for item in serializer.serialize(rows)}
+        results = [
+            dict(files[file_id], score=float(score)) for file_id, score in page if file_id in files
+        ]
+        return paginator.get_paginated_response(results)
+
+
+class FilePreviewView(APIView):
+    """
+    First lines of one of the authenticated user's files, read from the start
+    of the file only (GET /api/files/<file_id>/preview/?lines=&words=).
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [ORJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request, file_id, *args, **kwargs):
+        try:
+            lines = int(request.query_params.get('lines', settings.PREVIEW_MAX_LINES))
+            words = int(request.query_params.get('words', settings.PREVIEW_MAX_WORDS))
+        except ValueError:
+            return Response({"error": "lines and words must be integers"}, status=400)
+        lines = max(1, min(lines, settings.PREVIEW_MAX_LINES))
+        words = max(1, min(words, settings.PREVIEW_MAX_WORDS))
+
+        file_upload = get_object_or_404(FileUpload, id=file_id, user=request.user)
+        if not upload_exists(file_upload):
+            return Response({"error": "File not found on server"}, status=404)
+        try:
+            preview = get_preview(file_upload)
+        except (zipfile.BadZipFile, ElementTree.ParseError):
+            return Response({"error": "No preview available for this file"}, status=422)
+
+        data = slice_preview(preview, lines=lines, words=words)
+        data.update(file_id=file_upload.id, filename=file_upload.filename)
+        # Stored files never change, so the preview can be reused by the client
+        return Response(data, headers={'Cache-Control': 'private, max-age=3600'})
+
+
+class VocabularyView(APIView):
+    """
+    Estimated vocabulary size for the authenticated user, from the union of
+    their file sketches kept in UserStats (GET /api/vocabulary/), so it
+    matches ``unique_words`` in /api/stats/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        stored = UserStats.objects.filter(user=request.user).values_list('word_sketch', flat=True).first()
+        if stored:
+            sketch = HyperLogLog.from_bytes(stored)
+        else:
+            sketch = HyperLogLog(settings.WORD_SKETCH_PRECISION)
+        return Response({
+            "unique_words": sketch.count(),
+            "files": FileUpload.objects.filter(user=request.user, word_sketch__isnull=False).count(),
+            "precision": sketch.precision,
+        })
+
+
+class StatsView(APIView):
+    """
+    Aggregate totals and a daily time series for the authenticated user,
+    served from the rollup tables (GET /api/stats/?days=30).
+    """
+    permission_classes = [IsAuthenticated]
+    max_days = 365
+
+    def get(self, request, *args, **kwargs):
+        try:
+            days = int(request.query_params.get('days', 30))
+        except ValueError:
+            return Response({"error": "days must be an integer"}, status=400)
+        days = max(1, min(days, self.max_days))
+
+        return Response(user_stats_summary(request.user, days=days))
+
+
+class TransactionListView(VersionedCacheMixin, ReplicaReadMixin, ValuesListMixin, ListAPIView):
     """List payment transactions for the authenticated user."""
     permission_classes = [IsAuthenticated]
     serializer_class = PaymentTransactionSerializer
+    cache_scope = TRANSACTIONS
+    values_serializer_class = PaymentTransactionValuesSerializer
 
     def get_queryset(self):
         return PaymentTransaction.objects.filter(user=self.request.user)
 
 
-class ActivityListView(ListAPIView):
+class ActivityListView(VersionedCacheMixin, ReplicaReadMixin, ValuesListMixin, ListAPIView):
     """List activity logs for the authenticated user."""
     permission_classes = [IsAuthenticated]
     serializer_class = ActivityLogSerializer
+    cache_scope = ACTIVITY
+    values_serializer_class = ActivityLogValuesSerializer
 
     def get_queryset(self):
         return ActivityLog.objects.filter(user=self.request.user)
 
 
+class DashboardFilesView(VersionedCacheMixin, ReplicaReadMixin, RenderedRowsMixin, ListAPIView):
+    """Dashboard file rows, newest first (GET /api/dashboard/files/)."""
+    permission_classes = [IsAuthenticated]
+    pagination_class = DashboardPagination
+    cache_scope = FILES
+    ordering = '-upload_time'
+    page_size = 20
+    row_template = 'core/dashboard/files.html'
+
+    def get_queryset(self):
+        return FileUpload.objects.filter(user=self.request.user)
+
+
+class DashboardTransactionsView(VersionedCacheMixin, ReplicaReadMixin, RenderedRowsMixin, ListAPIView):
+    """Dashboard payment history rows (GET /api/dashboard/transactions/)."""
+    permission_classes = [IsAuthenticated]
+    pagination_class = DashboardPagination
+    cache_scope = TRANSACTIONS
+    ordering = '-timestamp'
+    page_size = 10
+    row_template = 'core/dashboard/transactions.html'
+
+    def get_queryset(self):
+        return PaymentTransaction.objects.filter(user=self.request.user)
+
+
+class DashboardActivityView(VersionedCacheMixin, ReplicaReadMixin, RenderedRowsMixin, ListAPIView):
+    """Dashboard recent activity rows (GET /api/dashboard/activity/)."""
+    permission_classes = [IsAuthenticated]
+    pagination_class = DashboardPagination
+    cache_scope = ACTIVITY
+    ordering = '-timestamp'
+    page_size = 10
+    row_template = 'core/dashboard/activity.html'
+
+    def get_queryset(self):
+        return ActivityLog.objects.filter(user=self.request.user)
+
+
+class ExportView(APIView):
+    """
+    Stream transactions or activity as CSV or NDJSON
+    (GET /api/export/<transactions|activity>/?format=csv&start=&end=&action=).
+    ``action`` filters ActivityLog.action or PaymentTransaction.status.
+    Staff may export every user's rows or pass ``user=<id>``.
+    """
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+
+    def get(self, request, kind, *args, **kwargs):
+        params = request.query_params
+        user = request.user
+        if user.is_staff:
+            user = params.get('user') or None
+
+        try:
+            columns, rows = export_rows(
+                kind,
+                user=user,
+                start=parse_bound(params.get('start')),
+                end=parse_bound(params.get('end'), end=True),
+                action=params.get('action'),
+                using=read_database(request.user),
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        fmt = request.accepted_renderer.format
+        response = StreamingHttpResponse(
+            iter_export(fmt, columns, rows),
+            content_type=f"{request.accepted_renderer.media_type}; charset=utf-8",
+        )
+        filename = f"{kind}-{timezone.now():%Y%m%d-%H%M%S}.{fmt}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes(token_bucket_throttles('payment'))
 def initiate_payment(request):
     """Initiate aamarPay payment (POST /api/initiate-payment/)"""
     user = request.user
@@ -159,7 +619,10 @@ def initiate_payment(request):
         "product_category": "Service"
     }
 
-    # Send to aamarPay sandbox
+    # Send to aamarPay sandbox. requests is imported here because only
+    # payment initiation needs it; other workers never load it.
+    import requests
+
     try:
         resp = requests.post(settings.AAMARPAY_ENDPOINT, json=payload, timeout=10)
         data = resp.json()
@@ -170,6 +633,7 @@ def initiate_payment(request):
         
         # Save gateway_response
         PaymentTransaction.objects.filter(transaction_id=tran_id).update(gateway_response=data)
+        bump_version(user.pk, TRANSACTIONS)
         
         if redirect_url:
             return Response({"redirect_url": redirect_url})
@@ -181,6 +645,7 @@ def initiate_payment(request):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])  # called by gateway (but you may add IP checks)
+@throttle_classes(token_bucket_throttles('payment_callback'))
 def payment_success(request):
     """Payment success callback (GET /api/payment/success/)"""
     # aamarPay will send query params / POST with data. Extract the tran_id & status.
@@ -191,12 +656,18 @@ def payment_success(request):
         return Response({"detail": "missing tran_id"}, status=400)
     
     try:
-        # Update transaction
-        tx = PaymentTransaction.objects.get(transaction_id=tran_id)
-        tx.status = 'success'
-        tx.gateway_response = dict(request.GET)
-        tx.timestamp = timezone.now()
-        tx.save()
+        # Update transaction. Gateways may retry the callback, even
+        # concurrently: the row lock makes only the first success count.
+        with transaction.atomic():
+            tx = PaymentTransaction.objects.select_for_update().get(transaction_id=tran_id)
+            already_successful = tx.status == 'success'
+            tx.status = 'success'
+            tx.gateway_response = dict(request.GET)
+            tx.timestamp = timezone.now()
+            tx.save()
+
+            if not already_successful:
+                record_payment(tx)
         
         # Log activity if tx has user
         if tx.user:
@@ -212,19 +683,32 @@ def payment_success(request):
         return Response({"detail": "Transaction not found"}, status=404)
 
 
+def _fail_transaction(tran_id, request):
+    """
+    Mark a transaction failed; returns it, or None if a success callback
+    already recorded it. A late fail / cancel callback must not undo a
+    payment counted in the stats rollups, which only count successes.
+    """
+    with transaction.atomic():
+        tx = PaymentTransaction.objects.select_for_update().get(transaction_id=tran_id)
+        if tx.status == 'success':
+            return None
+        tx.status = 'failed'
+        tx.gateway_response = dict(request.GET)
+        tx.save()
+    return tx
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes(token_bucket_throttles('payment_callback'))
 def payment_fail(request):
     """Payment failure callback"""
     tran_id = request.GET.get('tran_id')
     if tran_id:
         try:
-            tx = PaymentTransaction.objects.get(transaction_id=tran_id)
-            tx.status = 'failed'
-            tx.gateway_response = dict(request.GET)
-            tx.save()
-            
-            if tx.user:
+            tx = _fail_transaction(tran_id, request)
+            if tx and tx.user:
                 ActivityLog.objects.create(
                     user=tx.user,
                     action='payment_failed',
@@ -238,17 +722,14 @@ def payment_fail(request):
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
+@throttle_classes(token_bucket_throttles('payment_callback'))
 def payment_cancel(request):
     """Payment cancellation callback"""
     tran_id = request.GET.get('tran_id')
     if tran_id:
         try:
-            tx = PaymentTransaction.objects.get(transaction_id=tran_id)
-            tx.status = 'failed'
-            tx.gateway_response = dict(request.GET)
-            tx.save()
-            
-            if tx.user:
+            tx = _fail_transaction(tran_id, request)
+            if tx and tx.user:
                 ActivityLog.objects.create(
                     user=tx.user,
                     action='payment_cancelled',
@@ -260,21 +741,24 @@ def payment_cancel(request):
     return redirect('/dashboard/?payment=cancelled')
 
 
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
-
 @login_required
 def dashboard(request):
     """Dashboard view showing file upload form, files, and activity"""
     user = request.user
     
-    # Check if user has successful payment
-    has_payment = PaymentTransaction.objects.filter(user=user, status="success").exists()
-    
-    # Get user's data
-    files = FileUpload.objects.filter(user=user).order_by('-upload_time')
-    transactions = PaymentTransaction.objects.filter(user=user).order_by('-timestamp')
-    activities = ActivityLog.objects.filter(user=user).order_by('-timestamp')[:10]
+    with replica_reads(user):
+        return _render_dashboard(request, user)
+
+
+def _render_dashboard(request, user):
+    # The page is only a shell: its tables are filled in from the
+    # dashboard-* endpoints, so it costs the same for any history length.
+    # Whether the user has paid changes only with their transactions.
+    has_payment = cache.get_or_set(
+        f"dashboard:has-payment:{user.pk}:{get_version(user.pk, TRANSACTIONS)}",
+        lambda: PaymentTransaction.objects.filter(user=user, status="success").exists(),
+        settings.LIST_CACHE_TIMEOUT,
+    )
     
     # Get payment status from query params
     payment_status = request.GET.get('payment')
@@ -282,9 +766,6 @@ def dashboard(request):
     context = {
         'user': user,
         'has_payment': has_payment,
-        'files': files,
-        'transactions': transactions,
-        'activities': activities,
         'payment_status': payment_status == 'success',
     }
     
@@ -346,7 +827,7 @@ def download_file(request, file_id):
         file_upload = FileUpload.objects.get(id=file_id, user=request.user)
         
         # Check if file exists
-        if not os.path.exists(file_upload.file.path):
+        if not upload_exists(file_upload):
             return Response({"error": "File not found on server"}, status=404)
         
         # Log download activity
@@ -356,8 +837,24 @@ def download_file(request, file_id):
             metadata={"file_id": file_upload.id, "filename": file_upload.filename}
         )
         
-        # Return file response
-        response = FileResponse(open(file_upload.file.path, 'rb'))
+        # Return file response; compressed uploads are sent as stored to
+        # clients that accept the codec and decompressed for the rest. On S3
+        # stored bytes are fetched by the client from a presigned URL.
+        content_type = mimetypes.guess_type(file_upload.filename)[0] or 'application/octet-stream'
+        encoding = file_upload.encoding
+        accepted = bool(encoding) and accepts_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''), encoding)
+        url = download_url(file_upload, content_type, encoding) if accepted or not encoding else None
+        if url:
+            response = redirect(url)
+        elif accepted:
+            response = FileResponse(open_upload(file_upload, decode=False), content_type=content_type)
+            response['Content-Encoding'] = encoding
+        else:
+            response = FileResponse(open_upload(file_upload), content_type=content_type)
+            if encoding and file_upload.size is not None:
+                response['Content-Length'] = file_upload.size
+        if encoding:
+            response['Vary'] = 'Accept-Encoding'
         response['Content-Disposition'] = f'attachment; filename="{file_upload.filename}"'
         return response
         
@@ -381,12 +878,10 @@ def delete_file(request, file_id):
             metadata={"file_id": file_upload.id, "filename": file_upload.filename}
         )
         
-        # Delete the file from storage
-        if os.path.exists(file_upload.file.path):
-            os.remove(file_upload.file.path)
-        
-        # Delete the database record
-        file_upload.delete()
+        # Hide the record now; the sweeper removes the blob and the row
+        FileUpload.objects.filter(id=file_upload.id).update(deleted_at=timezone.now())
+        bump_version(request.user.pk, FILES)
+        transaction.on_commit(purge_deleted_files.delay)
         
         return Response({"message": "File deleted successfully"})
         
@@ -394,3 +889,56 @@ def delete_file(request, file_id):
         return Response({"error": "File not found"}, status=404)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def token_logout(request):
+    """Revoke the caller's API token (POST /api/auth/token/logout/)"""
+    Token.objects.filter(user=request.user).delete()
+    return Response(status=204)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def token_rotate(request):
+    """Replace the caller's API token with a new one (POST /api/auth/token/rotate/)"""
+    with transaction.atomic():
+        Token.objects.filter(user=request.user).delete()
+        token = Token.objects.create(user=request.user)
+    return Response({"token": token.key}, status=201)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_delete_files(request):
+    """
+    Delete many files at once (POST /api/files/bulk-delete/ with {"ids": [...]}).
+    Rows are soft-deleted in a single UPDATE and the blobs are removed later
+    by the purge_deleted_files sweeper.
+    """
+    ids = request.data.get('ids')
+    if not isinstance(ids, list) or not ids:
+        return Response({"error": "ids must be a non-empty list"}, status=400)
+    if len(ids) > settings.BULK_DELETE_MAX_FILES:
+        return Response({
+            "error": f"At most {settings.BULK_DELETE_MAX_FILES} files can be deleted per request."
+        }, status=400)
+    try:
+        ids = sorted({int(file_id) for file_id in ids})
+    except (TypeError, ValueError):
+        return Response({"error": "ids must be integers"}, status=400)
+
+    deleted = FileUpload.objects.filter(user=request.user, id__in=ids).update(
+        deleted_at=timezone.now()
+    )
+    if deleted:
+        bump_version(request.user.pk, FILES)
+        ActivityLog.objects.create(
+            user=request.user,
+            action="files_deleted",
+            metadata={"file_ids": ids, "deleted": deleted}
+        )
+        transaction.on_commit(purge_deleted_files.delay)
+
+    return Response({"deleted": deleted})